@@ -0,0 +1,99 @@
+# -*- coding: utf-8 -*-
+"""Detecção de anomalias nas séries mensais por município.
+
+Toda a matriz mês x município é processada de uma vez com NumPy:
+1. Valor esperado: mediana móvel centrada de `janela` meses (tendência) mais a
+   mediana, por mês do ano, da série sem tendência (sazonalidade);
+2. Escala: as séries são contagens sobredispersas (campanhas, unidades móveis),
+   então a variância é phi x esperado (quasi-Poisson), com o fator phi estimado
+   em conjunto para todos os municípios;
+3. z = (valor - esperado) / escala.
+
+Só são anomalias os picos isolados: z acima do `limite`, sem meses vizinhos
+também acima do limite (surtos de mais de um mês) e com excesso maior que
+`razao` vezes o de qualquer outro mês do município (picos recorrentes, como as
+campanhas anuais, não são isolados). Quedas só são tratadas com bilateral=True.
+Os picos podem ser winsorizados, isto é, limitados a esperado + limite x escala.
+"""
+
+import numpy as np
+import pandas as pd
+from numpy.lib.stride_tricks import sliding_window_view
+
+# Constante que torna o MAD comparável ao desvio padrão na distribuição normal:
+ESCALA_MAD = 1.4826
+
+
+# Valor esperado de cada mês por filtro de mediana sazonal (matriz meses x entidades):
+def filtro_mediana_sazonal(matriz, janela=7, periodo=12):
+  borda = janela // 2
+  matriz_estendida = np.pad(matriz, ((borda, borda), (0, 0)), mode='edge')
+  tendencia = np.median(sliding_window_view(matriz_estendida, janela, axis=0), axis=-1)
+
+  sem_tendencia = matriz - tendencia
+  sazonalidade = np.empty_like(matriz)
+  for mes in range(periodo):
+    sazonalidade[mes::periodo] = np.median(sem_tendencia[mes::periodo], axis=0)
+  return tendencia + sazonalidade
+
+
+# Fator de dispersão quasi-Poisson comum a todos os municípios: mediana, entre os municípios,
+# da variância robusta (MAD ao quadrado) dos resíduos de Pearson; mínimo 1 (Poisson).
+def estimar_dispersao(matriz, esperado):
+  pearson = (matriz - esperado) / np.sqrt(np.maximum(esperado, 1))
+  mad = np.median(np.abs(pearson - np.median(pearson, axis=0)), axis=0)
+  return max(float(np.median((ESCALA_MAD * mad) ** 2)), 1.0)
+
+
+# Valor esperado, escala e z de cada mês (matriz meses x entidades):
+def detectar_anomalias(matriz, janela=7, periodo=12):
+  esperado = np.maximum(filtro_mediana_sazonal(matriz, janela, periodo), 0)
+  escala = np.sqrt(estimar_dispersao(matriz, esperado) * np.maximum(esperado, 1))
+  return esperado, escala, (matriz - esperado) / escala
+
+
+# Picos isolados no tempo e não recorrentes (no máximo um por entidade):
+def picos_isolados(matriz, esperado, z, limite=5.0, razao=3.0):
+  acima = z > limite
+  vizinhos = np.zeros_like(acima)
+  vizinhos[1:] |= acima[:-1]
+  vizinhos[:-1] |= acima[1:]
+  excesso = matriz - esperado
+  segundo_maior = np.sort(excesso, axis=0)[-2] if len(matriz) > 1 else np.zeros(matriz.shape[1])
+  return acima & ~vizinhos & (excesso > razao * np.maximum(segundo_maior, 1))
+
+
+# Aplica a detecção sobre o pivot (index=data, columns=entidade) e devolve o pivot
+# winsorizado e o relatório com uma linha por anomalia (removido < 0 quando o valor foi elevado).
+# A primeira coluna do relatório leva o nome das colunas do pivot (por exemplo, CD_GEOCODI).
+def tratar_anomalias(df_pivot, janela=7, periodo=12, limite=5.0, razao=3.0, bilateral=False, winsorizar=True):
+  matriz = df_pivot.to_numpy(dtype='float64', na_value=0)
+  esperado, escala, z = detectar_anomalias(matriz, janela, periodo)
+  picos = picos_isolados(matriz, esperado, z, limite, razao)
+  quedas = picos_isolados(-matriz, -esperado, -z, limite, razao) if bilateral else np.zeros_like(picos)
+
+  corrigido = matriz
+  if winsorizar:
+    corrigido = np.where(picos, np.minimum(matriz, esperado + limite * escala).round(), matriz)
+    corrigido = np.where(quedas, np.maximum(matriz, esperado - limite * escala).round(), corrigido)
+
+  linhas, colunas = np.nonzero(picos | quedas)
+  df_relatorio = pd.DataFrame({
+      df_pivot.columns.name or 'entidade': df_pivot.columns[colunas],
+      'data': df_pivot.index[linhas],
+      'valor': matriz[linhas, colunas],
+      'esperado': esperado[linhas, colunas].round(2),
+      'z_robusto': z[linhas, colunas].round(2),
+      'valor_corrigido': corrigido[linhas, colunas],
+      'removido': matriz[linhas, colunas] - corrigido[linhas, colunas]
+  }).sort_values('z_robusto', key=np.abs, ascending=False, ignore_index=True)
+
+  return pd.DataFrame(corrigido, index=df_pivot.index, columns=df_pivot.columns), df_relatorio
+
+
+# Resumo do tratamento: anomalias, entidades afetadas e volume removido (total e proporção).
+def resumir_anomalias(df_relatorio, df_pivot):
+  total = float(np.nansum(df_pivot.to_numpy(dtype='float64', na_value=0)))
+  removido = float(df_relatorio.removido.sum())
+  return {'anomalias': len(df_relatorio), 'entidades': df_relatorio.iloc[:, 0].nunique(),
+          'volume_removido': removido, 'proporcao_removida': round(removido / max(total, 1), 4)}
@@ -0,0 +1,73 @@
+# -*- coding: utf-8 -*-
+"""Esquema de tipos dos datasets por cidade.
+
+Nomes de municípios e regiões se repetem a cada mês (81 vezes por cidade) e
+passam a ser categóricos; códigos e quantidades passam a inteiros de 32 bits.
+Colunas que podem receber NaN em merges com how='left' (códigos IBGE, lesões)
+usam inteiros anuláveis (Int32), evitando a conversão para float.
+"""
+
+import pandas as pd
+
+ESQUEMA = {
+    'municipio': 'category',
+    'nome_rgint': 'category',
+    'CD_GEOCODI': 'Int32',
+    'cod_reduzido': 'Int32',
+    'cod_rgi': 'Int32',
+    'cod_municipio': 'int32',
+    'qtd_exames': 'int32',
+    'qtd_exames_tratado': 'int32',
+    'qtd_lesoes': 'Int32',
+    'ano': 'int16'
+}
+
+# Tipo anulável usado quando uma coluna inteira recebe valores faltantes:
+ANULAVEIS = {'int16': 'Int16', 'int32': 'Int32', 'int64': 'Int64'}
+
+
+# Converte as colunas presentes no esquema; categorias sem uso (de merges/filtros) são removidas.
+def aplicar_esquema(df, esquema=ESQUEMA):
+  tipos = {}
+  for col, tipo in esquema.items():
+    if col not in df.columns:
+      continue
+    if tipo in ANULAVEIS and df[col].isna().any():
+      tipo = ANULAVEIS[tipo]
+    if str(df[col].dtype) != tipo:
+      tipos[col] = tipo
+  df = df.astype(tipos)
+  for col in df.columns:
+    if isinstance(df[col].dtype, pd.CategoricalDtype):
+      df[col] = df[col].cat.remove_unused_categories()
+  return df
+
+
+# Merge que mantém o esquema: chaves categóricas com categorias diferentes e
+# inteiros que recebem NaN voltariam para object/float no resultado.
+def mesclar(esquerda, direita, **parametros):
+  return aplicar_esquema(esquerda.merge(direita, **parametros))
+
+
+# Tipos padrão do pandas, sem o esquema (usados para comparar o uso de memória):
+def sem_esquema(df):
+  tipos = {}
+  for col in df.columns:
+    tipo = df[col].dtype
+    if isinstance(tipo, pd.CategoricalDtype):
+      tipos[col] = object
+    elif isinstance(tipo, pd.api.extensions.ExtensionDtype) and tipo.kind in 'iu':
+      tipos[col] = 'float64' if df[col].isna().any() else 'int64'
+    elif tipo.kind in 'iu':
+      tipos[col] = 'int64'
+  return df.astype(tipos)
+
+
+# Memória (MB) de cada dataset sem e com o esquema de tipos.
+def relatorio_memoria(datasets):
+  linhas = []
+  for nome, df in datasets.items():
+    antes = sem_esquema(df).memory_usage(deep=True).sum() / 2**20
+    depois = df.memory_usage(deep=True).sum() / 2**20
+    linhas.append([nome, round(antes, 2), round(depois, 2), f'{1 - depois / antes:.0%}'])
+  return pd.DataFrame(linhas, columns=['dataset', 'memoria_sem_esquema_mb', 'memoria_com_esquema_mb', 'reducao'])
@@ -0,0 +1,61 @@
+# -*- coding: utf-8 -*-
+"""Leitura, tratamento e enriquecimento dos arquivos do DataSUS (Tabnet).
+
+Único caminho de ingestão, usado tanto pelo notebook quanto pelo
+pipeline_estados.py:
+
+- ler_csv_datasus: leitura do .csv exportado do Tabnet;
+- tratar_resultados: resultados por mês (sem as linhas Ignorado e Total);
+- tratar_por_cidade: tabelas por município x mês em formato longo;
+- acrescentar_lesoes: total mensal de lesões nos resultados;
+- acrescentar_regioes: código IBGE, região imediata e intermediária de cada município.
+"""
+
+import pandas as pd
+
+from esquema import aplicar_esquema, mesclar
+from validacao import MESES, remover_totais
+
+MAPA_MES_DATA = {mes: indice + 1 for indice, mes in enumerate(MESES)}
+
+
+# Converter formato de data: JANEIRO/2023 -> 2023-01-01 (para a coluna inteira de uma vez)
+def converter_datas(serie):
+  partes = serie.str.split('/', expand=True)
+  return pd.to_datetime(pd.DataFrame({'year': partes[1].astype(int), 'month': partes[0].map(MAPA_MES_DATA), 'day': 1}))
+
+
+def ler_csv_datasus(caminho):
+  return pd.read_csv(caminho, sep = ';', decimal = ',', encoding = 'latin')
+
+
+# Tratar dataset de Resultados de Exames de Mamografia (sem as linhas Ignorado e Total):
+def tratar_resultados(df):
+  df = remover_totais(df, meses_em='linhas')
+  df.columns = ['mes_ano', 'normais', 'alterados', 'nao_visualizados', 'ignorados', 'total']
+  df = df.assign(mes_ano=converter_datas(df.mes_ano))
+  return df
+
+
+# Tratar datasets por Cidade e Mês/Ano (sem a linha de total e as colunas Ignorado e Total):
+def tratar_por_cidade(df, coluna_valor):
+  df = remover_totais(df)
+  df = df.melt(id_vars=[df.columns[0]], var_name = 'data', value_name=coluna_valor)
+  df.columns = ['municipio', 'data', coluna_valor]
+  partes = df.municipio.str.split(' ', n=1, expand=True)
+  df = df.assign(data=converter_datas(df.data), municipio=partes[1], cod_municipio=partes[0].astype(int))
+  return aplicar_esquema(df)
+
+
+# Acrescentar valores de lesões de câncer (soma mensal das cidades) no dataset de resultados:
+def acrescentar_lesoes(df_resultados, df_lesoes):
+  df_aux = pd.pivot_table(df_lesoes, index='data', values='qtd_lesoes', aggfunc='sum').reset_index()
+  return df_resultados.merge(df_aux, left_on='mes_ano', right_on='data', how='left')
+
+
+# Acrescentar microrregiões e código da cidade (o código do DataSUS é o CD_GEOCODI sem o dígito verificador):
+def acrescentar_regioes(df, df_macrorregioes, coluna_valor):
+  regioes = df_macrorregioes[['CD_GEOCODI','cod_rgi','nome_rgint']].assign(cod_reduzido=df_macrorregioes.CD_GEOCODI//10)
+  df = mesclar(df, regioes, left_on='cod_municipio', right_on='cod_reduzido', how='left')
+  df = df[['municipio','data',coluna_valor,'CD_GEOCODI','cod_rgi','nome_rgint']]
+  return df.assign(ano=df.data.dt.year.astype('int16'))
@@ -0,0 +1,238 @@
+# -*- coding: utf-8 -*-
+"""Leitura de planilhas ODS e XLSX com cache binário.
+
+O pd.read_excel(engine='odf') monta em memória o XML da pasta de trabalho
+inteira. Aqui o XML de uma única planilha é lido em fluxo (iterparse), linha a
+linha, extraindo apenas as colunas pedidas. O resultado é salvo em um arquivo
+binário ao lado da planilha (.<nome>.<chave>.pkl), reutilizado enquanto o
+tamanho e a data de modificação da planilha original não mudarem.
+
+Os tempos de cada leitura (caminho frio = XML, quente = cache) ficam em TEMPOS.
+"""
+
+import hashlib
+import os
+import pickle
+import re
+import tempfile
+import time
+import zipfile
+import xml.etree.ElementTree as ET
+
+import pandas as pd
+
+# Tempos de leitura registrados: {'arquivo', 'caminho': 'frio'|'quente', 'segundos'}
+TEMPOS = []
+
+NS_ODS = {
+    'table': 'urn:oasis:names:tc:opendocument:xmlns:table:1.0',
+    'office': 'urn:oasis:names:tc:opendocument:xmlns:office:1.0',
+    'text': 'urn:oasis:names:tc:opendocument:xmlns:text:1.0'
+}
+NS_XLSX = {
+    'main': 'http://schemas.openxmlformats.org/spreadsheetml/2006/main',
+    'rel': 'http://schemas.openxmlformats.org/officeDocument/2006/relationships',
+    'pkg': 'http://schemas.openxmlformats.org/package/2006/relationships'
+}
+
+
+def _tag(ns, prefixo, nome):
+  return '{' + ns[prefixo] + '}' + nome
+
+
+# Colunas só com números (inclusive números gravados como texto) são convertidas,
+# e as que não têm valores faltantes e só têm inteiros viram int64, como no pd.read_excel:
+def _montar_dataframe(cabecalho, linhas):
+  df = pd.DataFrame(linhas, columns=cabecalho)
+  for col in df.columns:
+    valores = pd.to_numeric(df[col], errors='coerce')
+    if valores.notna().sum() == df[col].notna().sum() > 0:
+      sem_faltantes = valores.notna().all() and (valores % 1 == 0).all()
+      df[col] = valores.astype('int64') if sem_faltantes else valores
+  return df
+
+
+# Separa o cabeçalho (primeira linha não vazia) das demais linhas e filtra as colunas pedidas:
+def _selecionar_colunas(iterador_linhas, colunas):
+  cabecalho = None
+  for linha in iterador_linhas:
+    if cabecalho is None:
+      if any(valor is not None for valor in linha):
+        cabecalho = [str(valor) for valor in linha]
+        nomes = colunas if colunas is not None else [nome for nome in cabecalho if nome != 'None']
+        faltantes = set(nomes) - set(cabecalho)
+        if faltantes:
+          raise KeyError(f'colunas não encontradas na planilha: {sorted(faltantes)}')
+        posicoes = [cabecalho.index(nome) for nome in nomes]
+        yield nomes
+      continue
+    yield [linha[posicao] if posicao < len(linha) else None for posicao in posicoes]
+
+
+# Valor de uma célula ODS conforme o tipo declarado em office:value-type:
+def _valor_celula_ods(celula):
+  tipo = celula.get(_tag(NS_ODS, 'office', 'value-type'))
+  if tipo is None:
+    return None
+  if tipo in ('float', 'percentage', 'currency'):
+    return float(celula.get(_tag(NS_ODS, 'office', 'value')))
+  if tipo == 'boolean':
+    return celula.get(_tag(NS_ODS, 'office', 'boolean-value')) == 'true'
+  if tipo == 'date':
+    return pd.Timestamp(celula.get(_tag(NS_ODS, 'office', 'date-value')))
+  return '\n'.join(''.join(p.itertext()) for p in celula.iter(_tag(NS_ODS, 'text', 'p')))
+
+
+def _linhas_ods(caminho, planilha):
+  tag_tabela = _tag(NS_ODS, 'table', 'table')
+  tag_linha = _tag(NS_ODS, 'table', 'table-row')
+  tag_celula = _tag(NS_ODS, 'table', 'table-cell')
+  tag_coberta = _tag(NS_ODS, 'table', 'covered-table-cell')
+  repeticao_colunas = _tag(NS_ODS, 'table', 'number-columns-repeated')
+  repeticao_linhas = _tag(NS_ODS, 'table', 'number-rows-repeated')
+
+  with zipfile.ZipFile(caminho) as arquivo, arquivo.open('content.xml') as conteudo:
+    indice_tabela, na_planilha = -1, False
+    for evento, elemento in ET.iterparse(conteudo, events=('start', 'end')):
+      if elemento.tag == tag_tabela:
+        if evento == 'start':
+          indice_tabela += 1
+          nome = elemento.get(_tag(NS_ODS, 'table', 'name'))
+          na_planilha = planilha in (indice_tabela, nome)
+        elif na_planilha:
+          return
+        continue
+      if evento != 'end' or elemento.tag != tag_linha:
+        continue
+      if na_planilha:
+        # Células vazias repetidas (até o fim das 16384 colunas) só são expandidas
+        # quando há algum valor depois delas:
+        linha, vazias = [], 0
+        for celula in elemento:
+          if celula.tag in (tag_celula, tag_coberta):
+            valor, repeticoes = _valor_celula_ods(celula), int(celula.get(repeticao_colunas, 1))
+            if valor is None:
+              vazias += repeticoes
+            else:
+              linha.extend([None] * vazias + [valor] * repeticoes)
+              vazias = 0
+        # Linhas vazias repetidas (comuns no fim da planilha) são ignoradas:
+        if linha:
+          for _ in range(int(elemento.get(repeticao_linhas, 1))):
+            yield linha
+      elemento.clear()
+
+
+def _coluna_xlsx(referencia):
+  letras = re.match(r'[A-Z]+', referencia).group()
+  indice = 0
+  for letra in letras:
+    indice = indice * 26 + ord(letra) - 64
+  return indice - 1
+
+
+def _linhas_xlsx(caminho, planilha):
+  with zipfile.ZipFile(caminho) as arquivo:
+    # Localiza o XML da planilha pelo índice ou nome em workbook.xml:
+    pasta = ET.fromstring(arquivo.read('xl/workbook.xml'))
+    planilhas = pasta.findall('main:sheets/main:sheet', NS_XLSX)
+    escolhida = next(p for i, p in enumerate(planilhas) if planilha in (i, p.get('name')))
+    relacoes = ET.fromstring(arquivo.read('xl/_rels/workbook.xml.rels'))
+    alvo = next(r.get('Target') for r in relacoes.findall('pkg:Relationship', NS_XLSX)
+                if r.get('Id') == escolhida.get(_tag(NS_XLSX, 'rel', 'id')))
+    alvo = alvo.lstrip('/') if alvo.startswith('/') else 'xl/' + alvo
+
+    textos = []
+    if 'xl/sharedStrings.xml' in arquivo.namelist():
+      with arquivo.open('xl/sharedStrings.xml') as compartilhados:
+        for _, elemento in ET.iterparse(compartilhados):
+          if elemento.tag == _tag(NS_XLSX, 'main', 'si'):
+            textos.append(''.join(t.text or '' for t in elemento.iter(_tag(NS_XLSX, 'main', 't'))))
+            elemento.clear()
+
+    tag_linha = _tag(NS_XLSX, 'main', 'row')
+    tag_valor = _tag(NS_XLSX, 'main', 'v')
+    with arquivo.open(alvo) as conteudo:
+      for _, elemento in ET.iterparse(conteudo):
+        if elemento.tag != tag_linha:
+          continue
+        linha = []
+        for celula in elemento:
+          posicao = _coluna_xlsx(celula.get('r'))
+          linha.extend([None] * (posicao - len(linha) + 1))
+          tipo, valor = celula.get('t', 'n'), celula.findtext(tag_valor)
+          if tipo == 'inlineStr':
+            linha[posicao] = ''.join(celula.itertext())
+          elif valor is None:
+            continue
+          elif tipo == 's':
+            linha[posicao] = textos[int(valor)]
+          elif tipo == 'b':
+            linha[posicao] = valor == '1'
+          elif tipo in ('str', 'e'):
+            linha[posicao] = valor
+          else:
+            linha[posicao] = float(valor)
+        # Linhas só com células formatadas, sem valores, são ignoradas:
+        if any(valor is not None for valor in linha):
+          yield linha
+        elemento.clear()
+
+
+# Lê a planilha diretamente do XML (caminho frio):
+def ler_xml(caminho, colunas=None, planilha=0):
+  leitor = _linhas_ods if caminho.lower().endswith('.ods') else _linhas_xlsx
+  linhas = _selecionar_colunas(leitor(caminho, planilha), colunas)
+  cabecalho = next(linhas)
+  return _montar_dataframe(cabecalho, list(linhas))
+
+
+# O pickle de um DataFrame só pode ser lido pela mesma versão do pandas, que por isso entra na chave:
+def caminho_cache(caminho, colunas=None, planilha=0):
+  chave = hashlib.md5(repr((colunas, planilha, pd.__version__)).encode('utf-8')).hexdigest()[:8]
+  pasta, nome = os.path.split(caminho)
+  return os.path.join(pasta, f'.{nome}.{chave}.pkl')
+
+
+# Grava o cache em um arquivo temporário na mesma pasta e o move para o destino com os.replace,
+# de modo que leitores simultâneos nunca vejam um arquivo gravado pela metade:
+def salvar_cache(arquivo_cache, conteudo):
+  pasta, nome = os.path.split(arquivo_cache)
+  descritor, temporario = tempfile.mkstemp(prefix=nome + '.', suffix='.tmp', dir=pasta or '.')
+  try:
+    with os.fdopen(descritor, 'wb') as f:
+      pickle.dump(conteudo, f, protocol=pickle.HIGHEST_PROTOCOL)
+    os.replace(temporario, arquivo_cache)
+  except BaseException:
+    os.remove(temporario)
+    raise
+
+
+# Lê a planilha pelo cache binário, quando ainda válido, ou pelo XML, recriando o cache.
+# Retorna (DataFrame, registro de tempo).
+def _ler_planilha(caminho, colunas=None, planilha=0, usar_cache=True):
+  inicio = time.perf_counter()
+  info = os.stat(caminho)
+  assinatura = (info.st_size, info.st_mtime_ns)
+  arquivo_cache = caminho_cache(caminho, colunas, planilha)
+
+  if usar_cache and os.path.exists(arquivo_cache):
+    try:
+      with open(arquivo_cache, 'rb') as f:
+        cache = pickle.load(f)
+    except Exception:
+      cache = None    # Cache corrompido: é recriado a partir do XML
+    # Qualquer conteúdo que não seja o dicionário esperado também é recriado:
+    if isinstance(cache, dict) and cache.get('assinatura') == assinatura and isinstance(cache.get('df'), pd.DataFrame):
+      return cache['df'], {'arquivo': caminho, 'caminho': 'quente', 'segundos': time.perf_counter() - inicio}
+
+  df = ler_xml(caminho, colunas, planilha)
+  if usar_cache:
+    salvar_cache(arquivo_cache, {'assinatura': assinatura, 'df': df})
+  return df, {'arquivo': caminho, 'caminho': 'frio', 'segundos': time.perf_counter() - inicio}
+
+
+def ler_planilha(caminho, colunas=None, planilha=0, usar_cache=True):
+  df, tempo = _ler_planilha(caminho, colunas, planilha, usar_cache)
+  TEMPOS.append(tempo)
+  return df
@@ -0,0 +1,102 @@
+# -*- coding: utf-8 -*-
+"""Estimação das participações (porcentagens) de regiões e cidades no total de exames.
+
+Todas as entidades são calculadas de uma vez sobre a matriz mês x entidade
+(resultado do pivot_table), com NumPy. Métodos disponíveis:
+- mediana: mediana de todo o histórico;
+- mediana_movel: mediana dos últimos `janela` meses;
+- exponencial: mediana ponderada com pesos que decaem pela metade a cada `meia_vida` meses;
+- aparada: média aparada, descartando `proporcao_corte` dos meses em cada ponta.
+
+Com filtrar=True, os picos isolados de cada entidade (como os 575 exames de
+ABAIRA em janeiro/2019) são antes winsorizados por anomalias.tratar_anomalias.
+O padrão é não filtrar, pois o notebook e o pipeline_estados.py já passam a
+quantidade tratada (qtd_exames_tratado); o backtest mede as duas opções.
+
+O método original do notebook (mediana do histórico bruto, sem filtro) entra no
+backtest como a linha de referência 'referencia'.
+"""
+
+import numpy as np
+import pandas as pd
+from scipy import stats
+
+from anomalias import tratar_anomalias
+
+METODOS = ('mediana', 'mediana_movel', 'exponencial', 'aparada')
+
+# Linha de referência do backtest: mediana do pivot bruto, sem filtro.
+REFERENCIA = 'referencia'
+
+
+# Mediana ponderada de cada coluna (pesos por linha):
+def mediana_ponderada(matriz, pesos):
+  ordem = np.argsort(matriz, axis=0)
+  valores = np.take_along_axis(matriz, ordem, axis=0)
+  pesos_acumulados = np.cumsum(pesos[ordem], axis=0)
+  posicao = (pesos_acumulados < pesos_acumulados[-1] / 2).sum(axis=0)
+  return valores[posicao, np.arange(matriz.shape[1])]
+
+
+# Valor típico de cada coluna da matriz (meses x entidades), conforme o método:
+def _valores_tipicos(matriz, metodo, janela, meia_vida, proporcao_corte):
+  if metodo == 'mediana':
+    return np.median(matriz, axis=0)
+  if metodo == 'mediana_movel':
+    return np.median(matriz[-janela:], axis=0)
+  if metodo == 'exponencial':
+    idade = np.arange(len(matriz))[::-1]
+    return mediana_ponderada(matriz, 0.5 ** (idade / meia_vida))
+  if metodo == 'aparada':
+    return stats.trim_mean(matriz, proporcao_corte, axis=0)
+  raise ValueError(f'metodo deve ser um de {METODOS}')
+
+
+# Participação de cada entidade (colunas do pivot) no total; a soma é igual a 1.
+def estimar_participacoes(df_pivot, metodo='mediana', janela=12, meia_vida=12, proporcao_corte=0.1,
+                          filtrar=False, limite_outlier=5.0):
+  if filtrar:
+    df_pivot = tratar_anomalias(df_pivot, limite=limite_outlier)[0]
+  matriz = df_pivot.to_numpy(dtype='float64', na_value=0)
+  valores = _valores_tipicos(matriz, metodo, janela, meia_vida, proporcao_corte)
+  return pd.Series(valores / valores.sum(), index=df_pivot.columns, name='porcentagem')
+
+
+# Backtest com origem móvel: estima as participações com os dados até cada origem e
+# compara com as participações realizadas nos `horizonte` meses seguintes, para cada
+# combinação de método e filtro (`filtros`: valores de filtrar testados).
+# erro: distância de variação total (metade da soma dos erros absolutos, entre 0 e 1);
+# variacao: mesma distância entre as estimativas de duas origens consecutivas (estabilidade).
+# df_realizado: pivot bruto (mesmo índice e colunas) com o qual as estimativas são comparadas,
+# para que o alvo não seja suavizado junto com as entradas (por padrão, o próprio df_pivot).
+# Quando informado, acrescenta a linha REFERENCIA: mediana sem filtro sobre o df_realizado.
+def backtest_participacoes(df_pivot, metodos=METODOS, inicio=24, horizonte=12, passo=6, filtros=(False, True),
+                           df_realizado=None, **parametros):
+  matriz = df_pivot.to_numpy(dtype='float64', na_value=0)
+  matriz_realizada = matriz
+  if df_realizado is not None:
+    matriz_realizada = df_realizado.reindex(index=df_pivot.index, columns=df_pivot.columns).to_numpy(dtype='float64', na_value=0)
+
+  # (rótulo, entrada, método, filtrar) de cada configuração testada:
+  configuracoes = [(metodo, matriz, metodo, filtrar) for filtrar in filtros for metodo in metodos]
+  if df_realizado is not None:
+    configuracoes.append((REFERENCIA, matriz_realizada, 'mediana', False))
+
+  linhas = []
+  for rotulo, entrada, metodo, filtrar in configuracoes:
+    anterior = None
+    for origem in range(inicio, len(matriz) - horizonte + 1, passo):
+      estimativa = estimar_participacoes(pd.DataFrame(entrada[:origem]), metodo, filtrar=filtrar, **parametros).to_numpy()
+      realizado = matriz_realizada[origem:origem + horizonte].sum(axis=0)
+      realizado = realizado / realizado.sum()
+      linhas.append([rotulo, filtrar, df_pivot.index[origem],
+                     np.abs(estimativa - realizado).sum() / 2,
+                     np.nan if anterior is None else np.abs(estimativa - anterior).sum() / 2])
+      anterior = estimativa
+  return pd.DataFrame(linhas, columns=['metodo', 'filtrar', 'origem', 'erro', 'variacao'])
+
+
+# (metodo, filtrar) de menor erro médio no backtest, entre as configurações aplicáveis ao df_pivot:
+def melhor_configuracao(df_backtest):
+  candidatos = df_backtest[df_backtest.metodo != REFERENCIA]
+  return candidatos.groupby(['metodo', 'filtrar']).erro.mean().idxmin()
@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""Execução particionada por estado (UF) e consolidação nacional.
+
+Cada estado passa, de forma independente e em um processo próprio, pelas
+etapas do notebook: leitura -> validação -> enriquecimento com as regiões -> previsão
+(Prophet) -> proporcionalização por cidade -> exportação. Cada processo
+recebe apenas os caminhos dos arquivos e o recorte da planilha de regiões do
+seu estado, de modo que a memória de cada processo é limitada aos dados de
+um estado. Ao final, as bases dos estados são concatenadas em bases
+nacionais, no formato lido pelo servidor_consultas.py. Um estado que falha
+(entradas inconsistentes, arquivos ausentes) é registrado na tabela de tempos
+e fica fora da consolidação, sem interromper os demais.
+
+Arquivos de entrada de cada estado (exportações do DataSUS/Tabnet):
+    <pasta_dados>/<UF>/resultados.csv      - exames por mês e tipo de resultado
+    <pasta_dados>/<UF>/exames_cidades.csv  - exames por município e mês
+    <pasta_dados>/<UF>/lesoes.csv          - lesões de câncer por município e mês
+
+Uso:
+    python pipeline_estados.py --pasta-dados dados --pasta-saida saida --processos 8
+"""
+
+import argparse
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+
+import pandas as pd
+
+from anomalias import resumir_anomalias, tratar_anomalias
+from esquema import aplicar_esquema, mesclar
+from estados import CODIGOS_UFS, UFS
+from ingestao import acrescentar_lesoes, acrescentar_regioes, ler_csv_datasus, tratar_por_cidade, tratar_resultados
+from leitura_planilhas import ler_planilha
+from participacoes import backtest_participacoes, estimar_participacoes, melhor_configuracao
+from proporcionalizacao import prever_com_amostras, proporcionalizar, proporcionalizar_amostras, somar_amostras_por_ano
+from validacao import exigir_consistencia, salvar_relatorio, validar_entradas
+
+ARQUIVO_REGIOES = 'regioes_geograficas_composicao_por_municipios_2017_20180911.ods'
+
+# Arquivos da Bahia na raiz do repositório, usados quando não há <pasta_dados>/BA:
+ARQUIVOS_BA = {
+    'resultados': 'mamografia_residba16984970756.csv',
+    'exames_cidades': 'mamografia_residba16987182839.csv',
+    'lesoes': 'mamografia_residba16988818099.csv'
+}
+
+# Meses previstos após o último mês observado (como no notebook: até dezembro de 2025):
+MESES_PREVISAO = 12*2+3
+
+
+def arquivos_estado(pasta_dados, uf):
+  pasta = os.path.join(pasta_dados, uf)
+  if not os.path.isdir(pasta) and uf == 'BA':
+    return dict(ARQUIVOS_BA)
+  return {tipo: os.path.join(pasta, tipo + '.csv') for tipo in ARQUIVOS_BA}
+
+
+# Previsão mensal de uma série com o Prophet: (predição, trajetórias de Monte Carlo meses x amostras)
+def prever(df_resultados, coluna, n_amostras):
+  from prophet import Prophet
+
+  treino = pd.DataFrame({'ds': df_resultados.mes_ano, 'y': df_resultados[coluna].to_numpy(dtype='float64')})
+  vetor_indice = pd.DataFrame({'ds': [treino.ds.iloc[-1] + pd.DateOffset(months=indice) for indice in range(1, MESES_PREVISAO+1)]})
+  m = Prophet(uncertainty_samples=n_amostras)
+  m.fit(treino)
+  return prever_com_amostras(m, vetor_indice)
+
+
+# Pipeline completo de um estado; grava as bases em <pasta_saida>/<UF> e devolve um resumo.
+def processar_estado(uf, arquivos, df_macrorregioes, pasta_saida, n_amostras=1000):
+  inicio = time.perf_counter()
+  pasta_estado = os.path.join(pasta_saida, uf)
+  os.makedirs(pasta_estado, exist_ok=True)
+
+  # Ingestão e validação dos arquivos brutos, antes de qualquer modelagem:
+  df_resultados_exames = ler_csv_datasus(arquivos['resultados'])
+  df_exames_cidades = ler_csv_datasus(arquivos['exames_cidades'])
+  df_lesoes_cancer = ler_csv_datasus(arquivos['lesoes'])
+  relatorio = validar_entradas(df_resultados_exames, df_exames_cidades, df_lesoes_cancer, df_macrorregioes)
+  salvar_relatorio(relatorio, os.path.join(pasta_estado, 'validacao_entradas.json'))
+  exigir_consistencia(relatorio)
+
+  df_resultados_exames = tratar_resultados(df_resultados_exames)
+  df_exames_cidades = tratar_por_cidade(df_exames_cidades, 'qtd_exames')
+  df_lesoes_cancer = tratar_por_cidade(df_lesoes_cancer, 'qtd_lesoes')
+
+  # Enriquecimento:
+  df_resultados_exames = acrescentar_lesoes(df_resultados_exames, df_lesoes_cancer)
+  df_resultados_exames['qtd_lesoes'] = df_resultados_exames.qtd_lesoes.fillna(0)
+  df_exames_cidades = acrescentar_regioes(df_exames_cidades, df_macrorregioes, 'qtd_exames')
+  df_lesoes_cancer = acrescentar_regioes(df_lesoes_cancer, df_macrorregioes, 'qtd_lesoes')
+
+  df_pivot_exames = pd.pivot_table(df_exames_cidades, index='data', columns='CD_GEOCODI', values='qtd_exames', aggfunc='sum')
+  df_aux, df_anomalias = tratar_anomalias(df_pivot_exames)
+  resumo_anomalias = resumir_anomalias(df_anomalias, df_pivot_exames)
+  df_anomalias.assign(uf=uf).to_csv(os.path.join(pasta_estado, 'anomalias_municipios.csv'), index=False)
+  df_aux = df_aux.stack().rename('qtd_exames_tratado').reset_index()
+  df_exames_cidades = mesclar(df_exames_cidades, df_aux, on=['CD_GEOCODI','data'], how='left')
+
+  # Previsão dos totais estaduais; os totais anuais são a média das trajetórias usadas nos intervalos:
+  totais_anuais = {}
+  for coluna in ['total', 'qtd_lesoes']:
+    predicao, amostras = prever(df_resultados_exames, coluna, n_amostras)
+    anos_previsao, totais_anuais[coluna] = somar_amostras_por_ano(predicao.ds, amostras)
+  df_resumo = pd.DataFrame({coluna: totais.mean(axis=1) for coluna, totais in totais_anuais.items()},
+                           index=pd.Index(anos_previsao, name='ano'))
+
+  # Proporcionalização por cidade:
+  df_aux = pd.pivot_table(df_exames_cidades, index='data', columns='CD_GEOCODI', values='qtd_exames_tratado', aggfunc='sum')
+  df_realizado = pd.pivot_table(df_exames_cidades, index='data', columns='CD_GEOCODI', values='qtd_exames', aggfunc='sum')
+  df_backtest = backtest_participacoes(df_aux, df_realizado=df_realizado)
+  metodo, filtrar = melhor_configuracao(df_backtest)
+  participacoes = estimar_participacoes(df_aux, metodo=metodo, filtrar=filtrar)
+
+  df_previsoes_base = pd.concat({
+      'qtd_exames': proporcionalizar(df_resumo.total, participacoes).stack(),
+      'qtd_lesoes': proporcionalizar(df_resumo.qtd_lesoes, participacoes).stack()
+  }, axis=1).rename_axis(['ano', 'CD_GEOCODI']).reset_index()
+  df_previsoes_base.to_csv(os.path.join(pasta_estado, 'base_previsoes.csv'), index=False)
+
+  intervalos = []
+  for coluna, nome in [('total', 'qtd_exames'), ('qtd_lesoes', 'qtd_lesoes')]:
+    estatisticas = proporcionalizar_amostras(anos_previsao, totais_anuais[coluna], participacoes)
+    intervalos.append(pd.concat({estatistica: df.stack() for estatistica, df in estatisticas.items()}, axis=1)
+                        .rename_axis(['ano', 'CD_GEOCODI']).reset_index().assign(serie=nome))
+  pd.concat(intervalos).to_csv(os.path.join(pasta_estado, 'intervalos_previsoes.csv'), index=False)
+
+  # Base histórica por cidade e ano:
+  df_historico = mesclar(df_exames_cidades, df_lesoes_cancer[['municipio','data','qtd_lesoes']], on=['municipio','data'], how='left')
+  df_historico = df_historico.groupby(['CD_GEOCODI','municipio','nome_rgint','ano'], observed=True)[['qtd_exames','qtd_lesoes']].sum().reset_index()
+  df_historico.to_csv(os.path.join(pasta_estado, 'base_historico.csv'), index=False)
+
+  # Resumo estadual por ano (histórico e previsão), usado na consolidação nacional:
+  df_resumo_estado = pd.concat([
+      df_historico.groupby('ano')[['qtd_exames', 'qtd_lesoes']].sum().assign(tipo='historico'),
+      df_previsoes_base.groupby('ano')[['qtd_exames', 'qtd_lesoes']].sum().assign(tipo='previsao')
+  ]).reset_index().assign(uf=uf)
+  return df_resumo_estado, {'uf': uf, 'municipios': df_historico.CD_GEOCODI.nunique(), 'avisos': relatorio['avisos'],
+                             'exames_removidos': resumo_anomalias['volume_removido'], 'segundos': time.perf_counter() - inicio}
+
+
+# Concatena as bases de todos os estados em bases nacionais, arquivo a arquivo:
+def consolidar(estados, pasta_saida):
+  for arquivo in ['base_historico.csv', 'base_previsoes.csv', 'intervalos_previsoes.csv', 'anomalias_municipios.csv']:
+    with open(os.path.join(pasta_saida, arquivo), 'w', encoding='utf-8') as saida:
+      for indice, uf in enumerate(estados):
+        with open(os.path.join(pasta_saida, uf, arquivo), encoding='utf-8') as entrada:
+          if indice > 0:
+            next(entrada)    # Cabeçalho só uma vez
+          saida.writelines(entrada)
+
+  # Relatório nacional de validação: {UF: relatório do estado}
+  relatorios = {}
+  for uf in estados:
+    with open(os.path.join(pasta_saida, uf, 'validacao_entradas.json'), encoding='utf-8') as entrada:
+      relatorios[uf] = json.load(entrada)
+  salvar_relatorio(relatorios, os.path.join(pasta_saida, 'validacao_entradas.json'))
+
+
+# Processa os estados em paralelo; a falha de um estado (entradas inconsistentes, pasta ausente,
+# erro no Prophet) é registrada na tabela de tempos e os demais são consolidados normalmente.
+def executar(estados, pasta_dados='dados', pasta_saida='saida', processos=None, n_amostras=1000):
+  if not estados:
+    raise ValueError(f'nenhum estado a processar (sem pastas de UF em {pasta_dados!r}?)')
+  desconhecidos = [uf for uf in estados if uf not in CODIGOS_UFS]
+  if desconhecidos:
+    raise ValueError(f'UFs desconhecidas: {desconhecidos}')
+  inicio = time.perf_counter()
+
+  # A planilha de regiões (Brasil inteiro) é lida uma vez e recortada por estado:
+  df_macrorregioes = aplicar_esquema(ler_planilha(ARQUIVO_REGIOES, colunas=['CD_GEOCODI','cod_rgi','nome_rgint']))
+  codigos_uf = df_macrorregioes.CD_GEOCODI // 100000
+
+  resumos, tempos, falhas = {}, [], []
+  with ProcessPoolExecutor(max_workers=processos) as executor:
+    futuros = {}
+    for uf in estados:
+      df_regioes_estado = aplicar_esquema(df_macrorregioes[codigos_uf == CODIGOS_UFS[uf]].reset_index(drop=True))
+      futuros[executor.submit(processar_estado, uf, arquivos_estado(pasta_dados, uf), df_regioes_estado, pasta_saida, n_amostras)] = uf
+    for futuro in as_completed(futuros):
+      uf = futuros[futuro]
+      try:
+        resumos[uf], tempo = futuro.result()
+        tempos.append({**tempo, 'erro': None})
+      except Exception as erro:
+        falhas.append({'uf': uf, 'segundos': float('nan'), 'erro': f'{type(erro).__name__}: {erro}'})
+
+  # Uma linha por estado, na ordem pedida, com a coluna de erro por último:
+  df_tempos = pd.DataFrame(tempos + falhas).set_index('uf').reindex(estados).reset_index()
+  df_tempos = df_tempos.assign(erro=df_tempos.pop('erro'))
+  duracao = time.perf_counter() - inicio
+  print(df_tempos.to_string(index=False))
+  print(f'Tempo total: {duracao:.1f} s | soma dos estados: {df_tempos.segundos.sum():.1f} s '
+        f'| aceleração: {df_tempos.segundos.sum() / duracao:.1f}x')
+
+  concluidos = [uf for uf in estados if uf in resumos]
+  if not concluidos:
+    raise RuntimeError('nenhum estado foi processado: ' + '; '.join(f'{t.uf}: {t.erro}' for t in df_tempos.itertuples()))
+  if len(concluidos) < len(estados):
+    print(f'Estados com falha (fora da consolidação): {sorted(set(estados) - set(concluidos))}')
+
+  consolidar(concluidos, pasta_saida)
+  df_resumo_nacional = pd.concat([resumos[uf] for uf in concluidos], ignore_index=True)
+  df_resumo_nacional.to_csv(os.path.join(pasta_saida, 'resumo_nacional.csv'), index=False)
+  return df_resumo_nacional
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Pipeline de mamografias particionado por estado.')
+  parser.add_argument('--estados', nargs='+', default=None,
+                      help='UFs a processar (padrão: todas com pasta em --pasta-dados)')
+  parser.add_argument('--pasta-dados', default='dados')
+  parser.add_argument('--pasta-saida', default='saida')
+  parser.add_argument('--processos', type=int, default=None, help='padrão: número de núcleos')
+  parser.add_argument('--amostras', type=int, default=1000, help='trajetórias de Monte Carlo por série')
+  args = parser.parse_args()
+
+  estados = args.estados
+  if estados is None:
+    estados = [uf for uf in UFS.values() if os.path.isdir(os.path.join(args.pasta_dados, uf))]
+  executar(estados, args.pasta_dados, args.pasta_saida, args.processos, args.amostras)
@@ -0,0 +1,133 @@
+# -*- coding: utf-8 -*-
+"""Proporcionalização das previsões estaduais para regiões e cidades.
+
+As quantidades são distribuídas pelas porcentagens de cada entidade e
+arredondadas pelo método dos maiores restos, de forma que a soma das
+entidades seja sempre igual ao total arredondado (o .astype('int') anterior
+truncava todas as parcelas e subestimava os totais).
+
+Além da previsão pontual (yhat), as trajetórias de Monte Carlo do Prophet
+(m.predictive_samples) são proporcionalizadas amostra a amostra, gerando
+intervalos de previsão por cidade. O processamento é feito em blocos de no
+máximo `tamanho_bloco` valores para limitar a memória.
+"""
+
+import numpy as np
+import pandas as pd
+
+# Quantidade máxima de valores (linhas x entidades) processados por bloco:
+TAMANHO_BLOCO = 2_000_000
+
+# Quantis padrão dos intervalos de previsão (intervalo de 80%, igual ao do Prophet):
+QUANTIS = {'inferior': 0.1, 'mediana': 0.5, 'superior': 0.9}
+
+# Tolerância na soma das porcentagens:
+TOLERANCIA_SOMA = 1e-6
+
+
+# Previsão do Prophet com um único sorteio de trajetórias: o m.predict sorteia outras amostras
+# para yhat_lower/yhat_upper, então ele é executado sem sorteio e os limites (e os de trend)
+# são calculados das mesmas trajetórias usadas nos intervalos. Retorna (predição, amostras de yhat).
+def prever_com_amostras(m, df_futuro):
+  amostras = m.predictive_samples(df_futuro)
+  n_amostras, m.uncertainty_samples = m.uncertainty_samples, 0
+  try:
+    predicao = m.predict(df_futuro)
+  finally:
+    m.uncertainty_samples = n_amostras
+  inferior, superior = 50 * (1 - m.interval_width), 50 * (1 + m.interval_width)
+  for chave in ['yhat', 'trend']:
+    predicao[chave + '_lower'] = np.percentile(amostras[chave], inferior, axis=1)
+    predicao[chave + '_upper'] = np.percentile(amostras[chave], superior, axis=1)
+  return predicao, amostras['yhat']
+
+
+# Soma as trajetórias mensais por ano -> (anos, matriz anos x amostras):
+def somar_amostras_por_ano(datas, amostras):
+  anos = pd.DatetimeIndex(datas).year.to_numpy()
+  anos_unicos, posicoes = np.unique(anos, return_inverse=True)
+  totais = np.zeros((len(anos_unicos), amostras.shape[1]))
+  np.add.at(totais, posicoes, amostras)
+  return anos_unicos, totais
+
+
+# Para cada linha, o último resto que ainda recebe +1 no método dos maiores restos.
+# Empates são resolvidos pela ordem das entidades (menor índice primeiro).
+def _limiares(valores, totais):
+  piso = np.floor(valores)
+  resto = valores - piso
+  faltam = np.clip(np.rint(totais) - piso.sum(axis=1), 0, valores.shape[1]).astype('int64')
+
+  ordem = np.argsort(-resto, axis=1, kind='stable')
+  linhas = np.arange(len(valores))
+  indice_limiar = ordem[linhas, np.maximum(faltam - 1, 0)]
+  resto_limiar = resto[linhas, indice_limiar]
+
+  # Linhas sem nada a distribuir não acrescentam em nenhuma entidade:
+  resto_limiar[faltam == 0] = np.inf
+  indice_limiar[faltam == 0] = -1
+  return resto_limiar, indice_limiar
+
+
+# Arredonda valores (linhas x entidades) a partir dos limiares de cada linha:
+def _arredondar(valores, colunas, resto_limiar, indice_limiar):
+  piso = np.floor(valores)
+  resto = valores - piso
+  acrescimo = (resto > resto_limiar[:, None]) | ((resto == resto_limiar[:, None]) & (colunas <= indice_limiar[:, None]))
+  return (piso + acrescimo).astype('int64')
+
+
+# Porcentagens finitas, não negativas e com soma 1 (participações de um histórico todo zerado
+# saem NaN em estimar_participacoes, o que quebraria o arredondamento):
+def _vetor_porcentagens(porcentagens):
+  vetor = porcentagens.to_numpy(dtype='float64')
+  if not np.isfinite(vetor).all() or (vetor < 0).any():
+    raise ValueError('porcentagens devem ser finitas e não negativas (histórico sem exames?)')
+  if abs(vetor.sum() - 1) > TOLERANCIA_SOMA:
+    raise ValueError(f'a soma das porcentagens deve ser 1 (soma = {vetor.sum():.6f})')
+  return vetor
+
+
+# Previsão pontual: distribui os totais pelas porcentagens preservando a soma.
+# totais: Series indexada por ano; porcentagens: Series indexada pela entidade.
+def proporcionalizar(totais, porcentagens):
+  vetor_totais = np.clip(totais.to_numpy(dtype='float64'), 0, None)
+  valores = vetor_totais[:, None] * _vetor_porcentagens(porcentagens)
+  resto_limiar, indice_limiar = _limiares(valores, vetor_totais)
+  alocacao = _arredondar(valores, np.arange(valores.shape[1]), resto_limiar, indice_limiar)
+  return pd.DataFrame(alocacao, index=totais.index, columns=porcentagens.index)
+
+
+# Previsão probabilística: distribui cada trajetória anual (anos x amostras) pelas
+# porcentagens e resume as amostras de cada entidade em média e quantis.
+# Retorna {estatistica: DataFrame(index=anos, columns=entidades)}.
+def proporcionalizar_amostras(anos, totais, porcentagens, quantis=QUANTIS, tamanho_bloco=TAMANHO_BLOCO):
+  n_anos, n_amostras = totais.shape
+  vetor_porcentagens = _vetor_porcentagens(porcentagens)
+  n_entidades = len(vetor_porcentagens)
+  linhas_totais = np.clip(totais, 0, None).reshape(-1)
+
+  # 1ª passada, em blocos de linhas: limiar de arredondamento de cada trajetória.
+  resto_limiar = np.empty(len(linhas_totais))
+  indice_limiar = np.empty(len(linhas_totais), dtype='int64')
+  passo = max(1, tamanho_bloco // n_entidades)
+  for inicio in range(0, len(linhas_totais), passo):
+    bloco = slice(inicio, inicio + passo)
+    valores = linhas_totais[bloco, None] * vetor_porcentagens
+    resto_limiar[bloco], indice_limiar[bloco] = _limiares(valores, linhas_totais[bloco])
+
+  # 2ª passada, em blocos de entidades: alocação inteira e resumo das amostras.
+  resultados = {nome: np.empty((n_anos, n_entidades)) for nome in ['media', *quantis]}
+  passo = max(1, tamanho_bloco // len(linhas_totais))
+  for inicio in range(0, n_entidades, passo):
+    colunas = np.arange(inicio, min(inicio + passo, n_entidades))
+    valores = linhas_totais[:, None] * vetor_porcentagens[colunas]
+    alocacao = _arredondar(valores, colunas, resto_limiar, indice_limiar).reshape(n_anos, n_amostras, len(colunas))
+
+    resultados['media'][:, colunas] = alocacao.mean(axis=1)
+    valores_quantis = np.quantile(alocacao, list(quantis.values()), axis=1, method='inverted_cdf')
+    for nome, valor in zip(quantis, valores_quantis):
+      resultados[nome][:, colunas] = valor
+
+  return {nome: pd.DataFrame(valores, index=pd.Index(anos, name='ano'), columns=porcentagens.index)
+          for nome, valores in resultados.items()}
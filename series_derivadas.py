@@ -0,0 +1,96 @@
+# -*- coding: utf-8 -*-
+"""Séries derivadas da EDA calculadas sob demanda e memorizadas.
+
+Em vez de copiar o dataset da EDA e acrescentar dezenas de colunas (diff_*,
+boxcox_*), cada série derivada é calculada na primeira vez em que é pedida e
+reaproveitada nas demais. Com o Copy-on-Write do pandas, as séries, fatias de
+treino/teste e a base são compartilhadas sem cópia: alterações feitas por quem
+as recebe geram uma cópia própria e não afetam o cache.
+
+Nomes aceitos em derivadas[nome]:
+- '<coluna>': série original;
+- 'diff_<coluna>': diferenciação com lag = 1;
+- 'boxcox_<coluna>': transformação Box-Cox de coluna + 1 (lambda em derivadas.lambdas).
+"""
+
+import pandas as pd
+from scipy import stats
+
+PREPROCESSAMENTOS = ('nenhum', 'diff', 'boxcox')
+
+
+class SeriesDerivadas:
+  """Base da EDA indexada pela data, com séries derivadas e divisões memorizadas."""
+
+  def __init__(self, df, colunas, indice='mes_ano'):
+    self.base = df.set_index(indice)[list(colunas)]
+    self.colunas = list(colunas)
+    self.lambdas = {}
+    self._cache = {}
+
+  def _memorizar(self, chave, calcular):
+    if chave not in self._cache:
+      self._cache[chave] = calcular()
+    return self._cache[chave]
+
+  def __getitem__(self, nome):
+    if isinstance(nome, list):
+      return pd.concat([self[n] for n in nome], axis=1)
+    if nome in self.base.columns:
+      return self.base[nome]
+
+    transformacao, _, coluna = nome.partition('_')
+    if coluna not in self.base.columns:
+      raise KeyError(nome)
+    if transformacao == 'diff':
+      return self._memorizar(nome, lambda: self.base[coluna].diff().rename(nome))
+    if transformacao == 'boxcox':
+      return self._memorizar(nome, lambda: self._boxcox(coluna).rename(nome))
+    raise KeyError(nome)
+
+  def _boxcox(self, coluna):
+    valores, self.lambdas[coluna] = stats.boxcox(self.base[coluna] + 1)
+    return pd.Series(valores, index=self.base.index)
+
+  # Divisão em treino e teste (fatias da base, com a data como coluna):
+  def divisao(self, proporcao=0.8):
+    def calcular():
+      indice = int(len(self.base) * proporcao)
+      return self.base.iloc[:indice].reset_index(), self.base.iloc[indice:].reset_index()
+    return self._memorizar(('divisao', proporcao), calcular)
+
+  # Dataset de treino do Prophet (ds, y) de uma coluna, já pré-processado.
+  # Retorna (treino, parametro da transformação inversa): primeiro valor (diff) ou lambda (boxcox).
+  def treino_prophet(self, coluna, preprocessamento='nenhum', proporcao=1.0):
+    def calcular():
+      serie = self.base[coluna].iloc[:int(len(self.base) * proporcao)]
+      parametro = None
+      if preprocessamento == 'diff':
+        parametro = serie.iloc[0]
+        serie = serie.diff().iloc[1:]    # Removendo NaN
+      elif preprocessamento == 'boxcox':
+        valores, parametro = stats.boxcox(serie + 1)
+        serie = pd.Series(valores, index=serie.index)
+      elif preprocessamento != 'nenhum':
+        raise ValueError(f'preprocessamento deve ser um de {PREPROCESSAMENTOS}')
+      return pd.DataFrame({'ds': serie.index, 'y': serie.to_numpy()}), parametro
+    return self._memorizar(('prophet', coluna, preprocessamento, proporcao), calcular)
+
+  # Descarta do cache o que depende de uma coluna (ou tudo), para ser recalculado no próximo acesso:
+  def invalidar(self, coluna=None):
+    for chave in list(self._cache):
+      if isinstance(chave, str):
+        dependencia = chave.partition('_')[2]
+      else:
+        dependencia = chave[1] if chave[0] == 'prophet' else coluna    # A divisão depende de todas as colunas
+      if coluna is None or dependencia == coluna:
+        del self._cache[chave]
+    if coluna is None:
+      self.lambdas.clear()
+    else:
+      self.lambdas.pop(coluna, None)
+
+  # Substitui uma coluna da base e recalcula, sob demanda, apenas o que depende dela:
+  def atualizar(self, coluna, valores):
+    self.base = self.base.assign(**{coluna: valores})
+    self.invalidar(coluna)
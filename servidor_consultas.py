@@ -0,0 +1,192 @@
+# -*- coding: utf-8 -*-
+"""Servidor local de consultas das quantidades históricas e previstas de mamografias.
+
+Lê as bases exportadas pelo notebook ou as bases nacionais do pipeline_estados.py
+(base_historico.csv e base_previsoes.csv), mantém os agregados em memória e
+responde em JSON, sem acesso à internet.
+
+Rotas:
+- /historico?nivel=municipio|regiao|estado&codigo=...&ano=...
+- /previsoes?nivel=municipio|regiao|estado&codigo=...&ano=...
+- /saude
+
+Uso:
+    python servidor_consultas.py --porta 8050
+"""
+
+import argparse
+import asyncio
+import json
+from functools import lru_cache
+from urllib.parse import urlsplit, parse_qsl
+
+import pandas as pd
+
+from estados import UFS
+
+# Bases exportadas na seção 5 do notebook:
+ARQUIVO_HISTORICO = 'base_historico.csv'
+ARQUIVO_PREVISOES = 'base_previsoes.csv'
+
+# Níveis de agregação e coluna usada como chave de cada um:
+NIVEIS = {
+    'municipio': 'CD_GEOCODI',
+    'regiao': 'nome_rgint',
+    'estado': 'estado'
+}
+
+ROTAS = ('historico', 'previsoes')
+
+STATUS_HTTP = {
+    200: 'OK',
+    400: 'Bad Request',
+    404: 'Not Found',
+    405: 'Method Not Allowed'
+}
+
+
+# Agrega uma base por nível e monta o dicionário {chave: {ano: {coluna: valor}}}:
+def agregar_por_nivel(df, coluna_chave):
+  colunas_valores = [col for col in df.columns if col.startswith('qtd_')]
+  df_agregado = df.groupby([coluna_chave, 'ano'])[colunas_valores].sum().reset_index()
+  agregados = {}
+  for linha in df_agregado.itertuples(index=False):
+    linha = linha._asdict()
+    chave = str(linha.pop(coluna_chave))
+    ano = int(linha.pop('ano'))
+    agregados.setdefault(chave, {})[ano] = {col: round(float(valor), 2) for col, valor in linha.items()}
+  return agregados
+
+
+class BaseConsultas:
+  """Agregados por rota e nível de todas as bases, mantidos em memória."""
+
+  def __init__(self, df_historico, df_previsoes):
+    # As previsões por cidade não trazem nome nem região, que vêm do histórico:
+    df_cidades = df_historico[['CD_GEOCODI', 'municipio', 'nome_rgint']].drop_duplicates('CD_GEOCODI')
+    df_previsoes = df_previsoes.drop(columns=['municipio', 'nome_rgint'], errors='ignore')
+    df_previsoes = df_previsoes.merge(df_cidades, on='CD_GEOCODI', how='left')
+
+    self.agregados = {}
+    for rota, df in zip(ROTAS, [df_historico, df_previsoes]):
+      df = df.dropna(subset=['CD_GEOCODI']).copy()
+      df['CD_GEOCODI'] = df.CD_GEOCODI.astype('int64')
+      df['estado'] = (df.CD_GEOCODI // 100000).map(UFS)    # Dois primeiros dígitos do código IBGE
+      for nivel, coluna_chave in NIVEIS.items():
+        self.agregados[(rota, nivel)] = agregar_por_nivel(df, coluna_chave)
+
+    self.nomes = dict(zip(df_cidades.CD_GEOCODI.dropna().astype('int64').astype(str), df_cidades.municipio))
+
+  @classmethod
+  def carregar(cls, arquivo_historico=ARQUIVO_HISTORICO, arquivo_previsoes=ARQUIVO_PREVISOES):
+    return cls(pd.read_csv(arquivo_historico), pd.read_csv(arquivo_previsoes))
+
+  def consultar(self, rota, nivel='municipio', codigo=None, ano=None):
+    agregados = self.agregados[(rota, nivel)]
+    chaves = [codigo] if codigo is not None else sorted(agregados)
+    resultado = []
+    for chave in chaves:
+      for ano_registro, valores in sorted(agregados.get(chave, {}).items()):
+        if ano is not None and ano_registro != ano:
+          continue
+        registro = {'nivel': nivel, 'codigo': chave, 'ano': ano_registro}
+        if nivel == 'municipio':
+          registro['municipio'] = self.nomes.get(chave)
+        registro.update(valores)
+        resultado.append(registro)
+    return resultado
+
+
+class ServidorConsultas:
+  """Servidor HTTP assíncrono com cache LRU das respostas já serializadas."""
+
+  def __init__(self, base, tamanho_cache=1024):
+    self.base = base
+    self.resposta_em_cache = lru_cache(maxsize=tamanho_cache)(self._montar_resposta)
+
+  # A rota /saude fica fora do cache para sempre refletir o estado atual:
+  def responder(self, alvo):
+    if urlsplit(alvo).path.strip('/') == 'saude':
+      return 200, self._json({'status': 'ok', 'cache': self.resposta_em_cache.cache_info()._asdict()})
+    return self.resposta_em_cache(alvo)
+
+  # Interpreta a URL e devolve (status, corpo JSON em bytes):
+  def _montar_resposta(self, alvo):
+    url = urlsplit(alvo)
+    rota = url.path.strip('/')
+    if rota not in ROTAS:
+      return 404, self._json({'erro': f'rota inexistente: /{rota}'})
+
+    parametros = dict(parse_qsl(url.query))
+    nivel = parametros.get('nivel', 'municipio')
+    if nivel not in NIVEIS:
+      return 400, self._json({'erro': f'nivel deve ser um de {list(NIVEIS)}'})
+    try:
+      ano = int(parametros['ano']) if 'ano' in parametros else None
+    except ValueError:
+      return 400, self._json({'erro': 'ano deve ser um número inteiro'})
+
+    resultado = self.base.consultar(rota, nivel, parametros.get('codigo'), ano)
+    if not resultado and 'codigo' in parametros:
+      return 404, self._json({'erro': f'codigo não encontrado: {parametros["codigo"]}'})
+    return 200, self._json(resultado)
+
+  @staticmethod
+  def _json(conteudo):
+    return json.dumps(conteudo, ensure_ascii=False).encode('utf-8')
+
+  async def atender(self, leitor, escritor):
+    try:
+      while True:
+        linha = await leitor.readline()
+        if not linha:
+          break
+        cabecalhos = {}
+        while True:
+          cabecalho = await leitor.readline()
+          if cabecalho in (b'\r\n', b'\n', b''):
+            break
+          nome, _, valor = cabecalho.decode('latin-1').partition(':')
+          cabecalhos[nome.strip().lower()] = valor.strip().lower()
+
+        partes = linha.decode('latin-1').split()
+        if len(partes) != 3:
+          status, corpo = 400, self._json({'erro': 'requisição inválida'})
+        elif partes[0] != 'GET':
+          status, corpo = 405, self._json({'erro': 'apenas GET é suportado'})
+        else:
+          status, corpo = self.responder(partes[1])
+
+        manter_conexao = cabecalhos.get('connection') != 'close' and partes[-1:] == ['HTTP/1.1']
+        escritor.write(
+          f'HTTP/1.1 {status} {STATUS_HTTP[status]}\r\n'
+          f'Content-Type: application/json; charset=utf-8\r\n'
+          f'Content-Length: {len(corpo)}\r\n'
+          f'Connection: {"keep-alive" if manter_conexao else "close"}\r\n\r\n'.encode('latin-1') + corpo
+        )
+        await escritor.drain()
+        if not manter_conexao:
+          break
+    except (ConnectionResetError, asyncio.IncompleteReadError):
+      pass
+    finally:
+      escritor.close()
+
+  async def executar(self, host='127.0.0.1', porta=8050):
+    servidor = await asyncio.start_server(self.atender, host, porta)
+    print(f'Servidor de consultas em http://{host}:{porta}')
+    async with servidor:
+      await servidor.serve_forever()
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Servidor local de consultas de mamografias.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--porta', type=int, default=8050)
+  parser.add_argument('--historico', default=ARQUIVO_HISTORICO)
+  parser.add_argument('--previsoes', default=ARQUIVO_PREVISOES)
+  parser.add_argument('--tamanho-cache', type=int, default=1024)
+  args = parser.parse_args()
+
+  base = BaseConsultas.carregar(args.historico, args.previsoes)
+  asyncio.run(ServidorConsultas(base, args.tamanho_cache).executar(args.host, args.porta))
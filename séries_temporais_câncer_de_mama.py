@@ -39,7 +39,8 @@ Título do Artigo:
   3.1 Divisão em conjunto de treino e teste  
   3.2 Comparando modelos  
   3.3 Gerando previsões  
-4. Resultados
+4. Resultados  
+5. Disponibilização dos resultados
 
 ## 1. Introdução
 
@@ -54,7 +55,7 @@ As bases de dados utilizadas foram adquiridas através do site do DataSUS e do I
 """
 
 # !pip install pmdarima
-!pip install odfpy
+# !pip install odfpy
 
 # Análise de dados e construção de gráficos
 import pandas as pd
@@ -88,130 +89,148 @@ from sklearn.metrics import mean_squared_error
 import warnings
 warnings.filterwarnings('ignore')
 
+# Copy-on-Write: seleções e fatias de DataFrames compartilham os dados até serem modificadas
+# (padrão e única opção a partir do pandas 3.0, onde a opção está obsoleta; nas versões 2.x é ativado aqui)
+if int(pd.__version__.split('.')[0]) < 3:
+  pd.set_option('mode.copy_on_write', True)
+
 # Modelo PROPHET
 from prophet import Prophet
 
+# Séries derivadas da EDA (diferenciação, Box-Cox, treino/teste) sob demanda
+from series_derivadas import SeriesDerivadas
+
+# Esquema de tipos dos datasets por cidade
+from esquema import aplicar_esquema, mesclar, relatorio_memoria
+
+# Validação da consistência dos arquivos do DataSUS
+from validacao import validar_entradas, salvar_relatorio, exigir_consistencia
+
+# Leitura, tratamento e enriquecimento dos arquivos do DataSUS (mesmo código do pipeline_estados.py)
+from ingestao import ler_csv_datasus, tratar_resultados, tratar_por_cidade, acrescentar_lesoes, acrescentar_regioes
+
+# Leitura de planilhas ODS/XLSX com cache binário
+from leitura_planilhas import ler_planilha, TEMPOS
+
+# Detecção de anomalias por município
+from anomalias import tratar_anomalias, resumir_anomalias
+
+# Participações de regiões e cidades e proporcionalização das previsões
+from participacoes import estimar_participacoes, backtest_participacoes, melhor_configuracao
+from proporcionalizacao import proporcionalizar, proporcionalizar_amostras, somar_amostras_por_ano, prever_com_amostras
+
 # Dataset de Resultados de Exames de Mamografia:
-df_resultados_exames = pd.read_csv('mamografia_residba16984970756.csv', sep = ';', decimal = ',', encoding = 'latin')
+df_resultados_exames = ler_csv_datasus('mamografia_residba16984970756.csv')
 df_resultados_exames
 
 # Dataset de Total de Exames por Cidade e Mês/Ano:
-df_exames_cidades = pd.read_csv('mamografia_residba16987182839.csv', sep = ';', decimal = ',', encoding = 'latin')
+df_exames_cidades = ler_csv_datasus('mamografia_residba16987182839.csv')
 df_exames_cidades
 
 # Dataset de Quantidade de Lesões de Câncer por Cidade e Mês/Ano:
-df_lesoes_cancer = pd.read_csv('mamografia_residba16988818099.csv', sep = ';', decimal = ',', encoding = 'latin')
+df_lesoes_cancer = ler_csv_datasus('mamografia_residba16988818099.csv')
 df_lesoes_cancer
 
-# Dataset Macrorregiões:
-df_macrorregioes = pd.read_excel('regioes_geograficas_composicao_por_municipios_2017_20180911.ods', engine='odf')
+# Dataset Macrorregiões (apenas as colunas utilizadas; o cache binário é reutilizado enquanto o .ods não mudar):
+df_macrorregioes = aplicar_esquema(ler_planilha('regioes_geograficas_composicao_por_municipios_2017_20180911.ods', colunas=['CD_GEOCODI','cod_rgi','nome_rgint']))
 df_macrorregioes
 
+# Tempos de leitura das planilhas (frio = XML, quente = cache):
+pd.DataFrame(TEMPOS)
+
 """## 2. Análise Exploratória dos Dados - EDA
 
 ---
 
 ### 2.1 Pré-processamento de Dados
+
+#### Validação das entradas
+
+Antes de qualquer tratamento, os três arquivos brutos são verificados em uma única passagem vetorizada: estrutura das linhas e colunas de total, soma das colunas igual à coluna de total (normais + alterados + nao_visualizados + ignorados = total) e soma das linhas igual à linha de total, valores faltantes ou negativos, códigos de municípios, meses faltantes, quantidades com mês "Ignorado", cobertura de meses entre os arquivos, total mensal dos resultados igual à soma dos exames por cidade e correspondência com a planilha de regiões.
+
+O relatório é salvo em `validacao_entradas.json`. Falhas de nível `erro` interrompem a execução; as de nível `aviso` registram perdas (meses ignorados) e preenchimentos (meses sem lesões, preenchidos com 0).
 """
 
-mapa_mes_data = {
-    'JANEIRO': 1,
-    'FEVEREIRO': 2,
-    'MARÇO': 3,
-    'ABRIL': 4,
-    'MAIO': 5,
-    'JUNHO': 6,
-    'JULHO': 7,
-    'AGOSTO': 8,
-    'SETEMBRO': 9,
-    'OUTUBRO': 10,
-    'NOVEMBRO': 11,
-    'DEZEMBRO': 12
-}
-
-# Converter formato de data: JANEIRO/2023 -> 2023-01-01
-def conversao_data(data):
-  mes_antigo = data.split('/')[0]
-  mes_atual = mapa_mes_data[mes_antigo]
-  data = data.replace(mes_antigo, str(mes_atual))
-  data = pd.to_datetime(data, dayfirst=True)
-  return data
-
-# Tratar dataset de Resultados de Exames de Mamografia:
-df_resultados_exames = df_resultados_exames.iloc[0:-2,:]
-df_resultados_exames.columns = ['mes_ano', 'normais', 'alterados', 'nao_visualizados', 'ignorados', 'total']
-df_resultados_exames.mes_ano = df_resultados_exames.mes_ano.apply(conversao_data)
+# Validação dos arquivos brutos:
+relatorio_validacao = validar_entradas(df_resultados_exames, df_exames_cidades, df_lesoes_cancer, df_macrorregioes)
+salvar_relatorio(relatorio_validacao, 'validacao_entradas.json')
+pd.DataFrame(relatorio_validacao['verificacoes'])
+
+# Interromper caso alguma verificação de nível erro tenha falhado:
+exigir_consistencia(relatorio_validacao)
+print(f"Erros: {relatorio_validacao['erros']} | Avisos: {relatorio_validacao['avisos']}")
+
+# Tratar dataset de Resultados de Exames de Mamografia (sem as linhas Ignorado e Total; JANEIRO/2023 -> 2023-01-01):
+df_resultados_exames = tratar_resultados(df_resultados_exames)
 df_resultados_exames
 
 # Tratar dataset de Total de Exames por Cidade e Mês/Ano:
-df_exames_cidades = df_exames_cidades.iloc[0:-1, 0:-1]
-df_exames_cidades = df_exames_cidades.melt(id_vars=["Munic.de residencia"], var_name = 'data', value_name="qtd_exames")
-df_exames_cidades.columns = ['municipio', 'data', 'qtd_exames']
-df_exames_cidades.data = df_exames_cidades.data.apply(conversao_data)
-df_exames_cidades['cod_municipio'] = df_exames_cidades.municipio.apply(lambda x: int(x.split(" ")[0]))
-df_exames_cidades['municipio'] = df_exames_cidades.municipio.apply(lambda x: x.split(" ", maxsplit=1)[1])
+df_exames_cidades = tratar_por_cidade(df_exames_cidades, 'qtd_exames')
 df_exames_cidades
 
 # Tratar dataset de Quantidade de Lesões de Câncer por Cidade e Mês/Ano:
-df_lesoes_cancer = df_lesoes_cancer.iloc[0:-1, 0:-2]
-df_lesoes_cancer = df_lesoes_cancer.melt(id_vars=["Munic.de residencia"], var_name = 'data', value_name="qtd_lesoes")
-df_lesoes_cancer.columns = ['municipio', 'data', 'qtd_lesoes']
-df_lesoes_cancer.data = df_lesoes_cancer.data.apply(conversao_data)
-df_lesoes_cancer['cod_municipio'] = df_lesoes_cancer.municipio.apply(lambda x: int(x.split(" ")[0]))
-df_lesoes_cancer['municipio'] = df_lesoes_cancer.municipio.apply(lambda x: x.split(" ", maxsplit=1)[1])
+df_lesoes_cancer = tratar_por_cidade(df_lesoes_cancer, 'qtd_lesoes')
 df_lesoes_cancer
 
 # Acrescentar valores de lesões de câncer no dataset de exames:
-df_aux = pd.pivot_table(df_lesoes_cancer, index='data', values='qtd_lesoes', aggfunc='sum').reset_index()
-
-df_resultados_exames = df_resultados_exames.merge(df_aux, left_on='mes_ano', right_on='data', how='left')
+df_resultados_exames = acrescentar_lesoes(df_resultados_exames, df_lesoes_cancer)
 df_resultados_exames
 
 # Acrescentar microrregioes e código da cidade no dataset de exames por cidade:
-df_macrorregioes['cod_reduzido'] = df_macrorregioes.CD_GEOCODI//10
-df_exames_cidades = df_exames_cidades.merge(df_macrorregioes[['cod_reduzido','CD_GEOCODI','cod_rgi','nome_rgint']],
-                                            left_on='cod_municipio',
-                                            right_on='cod_reduzido',
-                                            how='left')
-# df_exames_cidades.CD_GEOCODI = df_exames_cidades.nome_rgint
-# df_exames_cidades = df_exames_cidades.iloc[:,0:-2]
-df_exames_cidades = df_exames_cidades[['municipio','data','qtd_exames','CD_GEOCODI','cod_rgi','nome_rgint']]
-df_exames_cidades['ano'] = df_exames_cidades.data.dt.year
+df_exames_cidades = acrescentar_regioes(df_exames_cidades, df_macrorregioes, 'qtd_exames')
 df_exames_cidades
 
 # Acrescentar microrregioes e código da cidade no dataset de lesoes por cidade:
-df_macrorregioes['cod_reduzido'] = df_macrorregioes.CD_GEOCODI//10
-df_lesoes_cancer = df_lesoes_cancer.merge(df_macrorregioes[['cod_reduzido','CD_GEOCODI','cod_rgi','nome_rgint']],
-                                            left_on='cod_municipio',
-                                            right_on='cod_reduzido',
-                                            how='left')
-# df_exames_cidades.CD_GEOCODI = df_exames_cidades.nome_rgint
-# df_exames_cidades = df_exames_cidades.iloc[:,0:-2]
-df_lesoes_cancer = df_lesoes_cancer[['municipio','data','qtd_lesoes','CD_GEOCODI','cod_rgi','nome_rgint']]
-df_lesoes_cancer['ano'] = df_lesoes_cancer.data.dt.year
+df_lesoes_cancer = acrescentar_regioes(df_lesoes_cancer, df_macrorregioes, 'qtd_lesoes')
 df_lesoes_cancer
 
+"""### Detecção de anomalias por município
+
+Algumas cidades apresentam picos isolados (por exemplo, 575 exames em janeiro/2019 em ABAIRA, que registra de 0 a 3 exames nos demais meses), que distorcem as participações usadas na proporcionalização.
+
+O valor esperado de cada mês é obtido por um filtro de mediana sazonal (mediana móvel de 7 meses + mediana por mês do ano). Como as contagens são sobredispersas (campanhas do Outubro Rosa, unidades móveis), a escala dos resíduos usa um fator de dispersão quasi-Poisson estimado em conjunto para todos os municípios.
+
+Só são marcados os picos isolados: z > 5, sem meses vizinhos também acima do limite e com excesso pelo menos 3 vezes maior que o de qualquer outro mês do município. Surtos recorrentes ou de vários meses são mantidos, e meses abaixo do esperado não são preenchidos. Os picos são winsorizados na coluna `qtd_exames_tratado`; a coluna `qtd_exames` mantém os valores originais e é usada como referência no backtest das participações.
+"""
+
+# Detecção de anomalias na quantidade de exames por município:
+df_pivot_exames = pd.pivot_table(df_exames_cidades, index='data', columns='CD_GEOCODI', values='qtd_exames', aggfunc='sum')
+df_aux, df_anomalias = tratar_anomalias(df_pivot_exames)
+df_anomalias.to_csv('anomalias_municipios.csv', index=False)
+resumo_anomalias = resumir_anomalias(df_anomalias, df_pivot_exames)
+print(f"{resumo_anomalias['anomalias']} anomalias em {resumo_anomalias['entidades']} municípios | "
+      f"exames removidos: {resumo_anomalias['volume_removido']:.0f} ({resumo_anomalias['proporcao_removida']:.2%})")
+df_anomalias.head(20)
+
+# Quantidade de exames tratada (winsorizada), usada na proporcionalização:
+df_aux = df_aux.stack().rename('qtd_exames_tratado').reset_index()
+df_exames_cidades = mesclar(df_exames_cidades, df_aux, on=['CD_GEOCODI','data'], how='left')
+df_exames_cidades
+
 # Exportar dados no formato aceito pelo VYR:
-df_vyr = df_exames_cidades.copy()
-df_vyr = df_vyr.merge(df_lesoes_cancer[['municipio','data','qtd_lesoes']], on=['municipio','data'], how='left')
+df_vyr = mesclar(df_exames_cidades, df_lesoes_cancer[['municipio','data','qtd_lesoes']], on=['municipio','data'], how='left')
 df_vyr = df_vyr[['municipio','CD_GEOCODI','ano','qtd_exames','qtd_lesoes']]
-df_vyr = df_vyr.groupby(['municipio','CD_GEOCODI','ano']).sum()
+df_vyr = df_vyr.groupby(['municipio','CD_GEOCODI','ano'], observed=True).sum()
 df_vyr = df_vyr.reset_index()
 for ano in df_vyr.ano.unique():
   df_vyr[df_vyr.ano==ano].to_excel('df_vyy'+str(ano)+'.xlsx', index=False)
 
 df_vyr
 
+# Uso de memória dos datasets por cidade sem e com o esquema de tipos:
+relatorio_memoria({'df_exames_cidades': df_exames_cidades, 'df_lesoes_cancer': df_lesoes_cancer, 'df_vyr': df_vyr})
+
 """### 2.4 Análise Univariada"""
 
 # Estatística descritiva:
 df_resultados_exames.describe().T
 
-# Preencher valores nulos com 0:
-df_resultados_exames.qtd_lesoes.fillna(0, inplace=True)
+# Preencher com 0 os meses sem registro de lesões (verificação cobertura_meses da validação).
+# Atribuição explícita, pois com Copy-on-Write o fillna inplace na coluna não altera o dataset:
+df_resultados_exames['qtd_lesoes'] = df_resultados_exames.qtd_lesoes.fillna(0)
 
-# Criando backup dos dados para EDA:
-df_EDA = df_resultados_exames.copy()
+# Dados para EDA (somente leitura, sem cópia):
+df_EDA = df_resultados_exames
 
 # Plotando dados importados:
 fig = px.line(df_EDA,
@@ -249,17 +268,15 @@ for x in atr_numericos:
 
 """### 2.5 Decomposição da Série Temporal"""
 
-# Criando dataset para decomposição:
-df_EDA_decomposicao = df_EDA.copy()
-df_EDA_decomposicao = df_EDA_decomposicao[['mes_ano','normais', 'alterados', 'nao_visualizados', 'ignorados', 'total', 'qtd_lesoes']]
-df_EDA_decomposicao.set_index('mes_ano', inplace = True)
-df_EDA_decomposicao.head(2)
+# Criando dataset para decomposição (as séries derivadas são calculadas sob demanda e memorizadas):
+derivadas = SeriesDerivadas(df_EDA, ['normais', 'alterados', 'nao_visualizados', 'ignorados', 'total', 'qtd_lesoes'])
+derivadas.base.head(2)
 
 # Decomposição aditiva: melhor quando a amplitude da sazonalidade NÃO DEPENDE do valor da trend.
 # A decomposição multiplicativa é melhor quando a amplitude da sazonalidade DEPENDE do valor da trend.
-for coluna in df_EDA_decomposicao.columns:
+for coluna in derivadas.base.columns:
 
-  decomposicao_aditiva = seasonal_decompose(df_EDA_decomposicao[coluna], model = 'aditive')
+  decomposicao_aditiva = seasonal_decompose(derivadas.base[coluna], model = 'aditive')
 
   figures = [px.line(decomposicao_aditiva.observed,  y=coluna, title=coluna),
             px.line(decomposicao_aditiva.trend,  y='trend', title='Componente de Tendência'),
@@ -279,7 +296,7 @@ for coluna in df_EDA_decomposicao.columns:
   fig.show()
 
 # Estatística dos resíduos:
-for coluna in df_EDA_decomposicao.columns:
+for coluna in derivadas.base.columns:
   figures = [px.histogram(decomposicao_aditiva.resid, x="resid"),
             px.box(decomposicao_aditiva.resid, y="resid")]
 
@@ -348,9 +365,9 @@ def teste_estacionario(dados):
         return("Série Não Estacionária")
 
 # Aplicando função:
-for coluna in df_EDA_decomposicao.columns:
+for coluna in derivadas.base.columns:
   print(f'Atributo: {coluna}')
-  print(teste_estacionario(df_EDA_decomposicao[coluna]))
+  print(teste_estacionario(derivadas.base[coluna]))
   print("=======================================================")
 
 """### 2.7 Técnicas para tornar a série temporal estacionária
@@ -363,57 +380,52 @@ Serão aplicadas as seguintes técnicas para tornar a série estacionária:
 """
 
 # Diferenciando lag = 1 (consumo = consumo_(t) - consumo_(t-1))
-df_EDA_decomposicao['diff_normais'] = df_EDA_decomposicao.normais.diff()
-df_EDA_decomposicao['diff_alterados'] = df_EDA_decomposicao.alterados.diff()
-df_EDA_decomposicao['diff_nao_visualizados'] = df_EDA_decomposicao.nao_visualizados.diff()
-df_EDA_decomposicao['diff_ignorados'] = df_EDA_decomposicao.ignorados.diff()
-df_EDA_decomposicao['diff_total'] = df_EDA_decomposicao.total.diff()
-df_EDA_decomposicao['diff_qtd_lesoes'] = df_EDA_decomposicao.qtd_lesoes.diff()
-df_EDA_decomposicao.head(4)
+colunas_diff = ['diff_' + coluna for coluna in derivadas.colunas]
+derivadas[colunas_diff].head(4)
 
 # Aplicando função:
-for coluna in df_EDA_decomposicao.columns[-6:]:
+for coluna in colunas_diff:
   print(f'Atributo: {coluna}')
-  print(teste_estacionario(df_EDA_decomposicao[coluna].iloc[1:]))
+  print(teste_estacionario(derivadas[coluna].iloc[1:]))
   print("=======================================================")
 
 """Com a primeira diferenciação, as séries se tornam estacionárias, conforme resultado dos testes acima.
 Abaixo segue como ficaram as distribuições dos grupos com a diferenciação:
 """
 
-df_EDA_decomposicao.columns[-6:]
+colunas_diff
 
 # Gráfico da diferenciação com lag = 1 dos consumos:
-fig = px.line(df_EDA_decomposicao.iloc[1:],
-              y=['diff_normais', 'diff_alterados', 'diff_nao_visualizados','diff_ignorados', 'diff_total', 'diff_qtd_lesoes'],
+fig = px.line(derivadas[colunas_diff].iloc[1:],
+              y=colunas_diff,
               title='Diferenciação')
 fig.show()
 
 """#### 2.7.2 Transformação Boxcox"""
 
 vetor_lambda = []
+colunas_boxcox = ['boxcox_' + coluna for coluna in derivadas.colunas]
 # Transformação Boxcox:
-for coluna in df_EDA_decomposicao.columns[0:6]:
-  # Calculando lambda:
-  df_box_cox, best_lambda = stats.boxcox(df_EDA_decomposicao[coluna]+1)
+for coluna in derivadas.colunas:
+  # Calculando transformação e lambda:
+  df_box_cox = derivadas['boxcox_'+coluna]
+  best_lambda = derivadas.lambdas[coluna]
   vetor_lambda.append(best_lambda)
   print(f'Atributo: {coluna}\n')
   print(f'Valor de lambda: {best_lambda}')
-  # Inserindo valores transformados no dataset:
-  df_EDA_decomposicao['boxcox_'+coluna] = df_box_cox
   # Aplicando função:
   print(teste_estacionario(df_box_cox))
   print("=======================================================\n")
 
-df_EDA_decomposicao.head(6)
+derivadas[derivadas.colunas + colunas_diff + colunas_boxcox].head(6)
 
 """Nesse caso, não houve uma melhoria associada ao uso da transformação boxcox, pois as séries permaneceram não estacionárias. Um refinamento do parâmetro lambda pode contornar essa situação.
 
 Abaixo segue como ficou a distribuição dos dados:
 """
 
-fig = px.line(df_EDA_decomposicao,
-              y=['boxcox_normais','boxcox_alterados','boxcox_nao_visualizados','boxcox_ignorados','boxcox_total','boxcox_qtd_lesoes'],
+fig = px.line(derivadas[colunas_boxcox],
+              y=colunas_boxcox,
               title='BoxCox')
 fig.show()
 
@@ -425,21 +437,21 @@ A autocorrelação parcial desconsidera a influência dos lags anteriores.
 """
 
 # Gráfico de autocorrelação total:
-for coluna in df_EDA_decomposicao.columns[0:6]:
+for coluna in derivadas.colunas:
   fig, axes = plt.subplots(1,3, figsize=(20,5))
-  plot_acf(df_EDA_decomposicao[coluna], ax=axes[0]);
-  plot_acf(df_EDA_decomposicao['diff_'+coluna].iloc[1:], ax=axes[1]);
-  plot_acf(df_EDA_decomposicao['boxcox_'+coluna], ax=axes[2]);
+  plot_acf(derivadas.base[coluna], ax=axes[0]);
+  plot_acf(derivadas['diff_'+coluna].iloc[1:], ax=axes[1]);
+  plot_acf(derivadas['boxcox_'+coluna], ax=axes[2]);
   axes[0].set_xlabel(coluna);
   axes[1].set_xlabel(coluna + " - Diferenciação");
   axes[2].set_xlabel(coluna + " - BoxCox");
 
 # Gráfico de autocorrelação parcial:
-for coluna in df_EDA_decomposicao.columns[0:6]:
+for coluna in derivadas.colunas:
   fig, axes = plt.subplots(1,3, figsize=(20,5))
-  plot_pacf(df_EDA_decomposicao[coluna], ax=axes[0]);
-  plot_pacf(df_EDA_decomposicao['diff_'+coluna].iloc[1:], ax=axes[1]);
-  plot_pacf(df_EDA_decomposicao['boxcox_'+coluna], ax=axes[2]);
+  plot_pacf(derivadas.base[coluna], ax=axes[0]);
+  plot_pacf(derivadas['diff_'+coluna].iloc[1:], ax=axes[1]);
+  plot_pacf(derivadas['boxcox_'+coluna], ax=axes[2]);
   axes[0].set_xlabel(coluna);
   axes[1].set_xlabel(coluna + " - Diferenciação");
   axes[2].set_xlabel(coluna + " - BoxCox");
@@ -452,12 +464,7 @@ O método de avaliação entre os modelos será a Raiz do Erro Médio Quadrátic
 """
 
 # Separando em 80%|20%:
-indice = int(len(df_EDA)*0.8)
-
-df_EDA_treino = df_EDA.iloc[:indice, :]
-df_EDA_treino = df_EDA_treino[['mes_ano','normais', 'alterados', 'nao_visualizados', 'ignorados', 'total', 'qtd_lesoes']]
-df_EDA_teste = df_EDA.iloc[indice:, :]
-df_EDA_teste = df_EDA_teste[['mes_ano','normais', 'alterados', 'nao_visualizados', 'ignorados', 'total', 'qtd_lesoes']]
+df_EDA_treino, df_EDA_teste = derivadas.divisao(0.8)
 
 print('Dataset treino:')
 display(df_EDA_treino.head())
@@ -474,20 +481,8 @@ resultados = pd.DataFrame(columns = ['grupo', 'preprocessamento','rmse'])
 
 for coluna in df_EDA_treino.columns[1:]:
   for prep in preprocessamento:
-    # Treino:
-    treino = df_EDA_treino[['mes_ano',coluna]].copy()
-    treino.columns = ['ds','y']
-
-    # Transformação:
-    if prep == 'nenhum':
-        pass
-    elif prep == 'diff':
-        primeiro_valor = treino.y[0]
-        treino.y = treino.y.diff()
-        treino = treino.iloc[1:,:]    # Removendo NaN
-    elif prep == 'boxcox':
-        treino_box, best_lambda = stats.boxcox(treino.y+1)
-        treino.y = treino_box
+    # Treino com transformação (memorizado; parâmetro = primeiro valor no diff ou lambda no boxcox):
+    treino, parametro = derivadas.treino_prophet(coluna, prep, 0.8)
 
     # Rodando modelo:
     m = Prophet()
@@ -507,10 +502,10 @@ for coluna in df_EDA_treino.columns[1:]:
         pass
     elif prep == 'diff':
         inv_diff = predicao.yhat.cumsum()
-        inv_diff = inv_diff.fillna(0) + primeiro_valor
+        inv_diff = inv_diff.fillna(0) + parametro
         predicao.yhat = inv_diff
     elif prep == 'boxcox':
-        predicao.yhat = inv_boxcox(predicao.yhat, best_lambda)-1
+        predicao.yhat = inv_boxcox(predicao.yhat, parametro)-1
 
     # Calculando RMSE:
     rmse_prophet = mean_squared_error(df_EDA_teste[coluna], predicao.yhat, squared = True)
@@ -538,6 +533,11 @@ display(resultados)
 # Dataset com previsões:
 previsoes = pd.DataFrame()
 
+# Trajetórias de Monte Carlo das séries propagadas às regiões e cidades (total e qtd_lesoes),
+# usadas nos intervalos de previsão e nos totais anuais:
+n_amostras = 1000
+amostras = {}
+
 # Calculando índices de início e término da previsão:
 vetor_indice = []
 for indice in range(1,12*2+4):
@@ -546,8 +546,7 @@ vetor_indice = pd.DataFrame(vetor_indice, columns = ["ds"])
 
 # normais:
 coluna = 'normais'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # Rodando modelo:
 m = Prophet()
@@ -572,8 +571,7 @@ previsoes[coluna] = predicao.yhat
 
 # alterados:
 coluna = 'alterados'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # # Transformação Box-Cox:
 # treino_box, best_lambda = stats.boxcox(treino.y+1)
@@ -612,8 +610,7 @@ previsoes[coluna] = predicao.yhat
 
 # nao_visualizados:
 coluna = 'nao_visualizados'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # # Transformação Box-Cox:
 # treino_box, best_lambda = stats.boxcox(treino.y+1)
@@ -652,8 +649,7 @@ previsoes[coluna] = predicao.yhat
 
 # ignorados:
 coluna = 'ignorados'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # # Transformação Box-Cox:
 # treino_box, best_lambda = stats.boxcox(treino.y+1)
@@ -692,8 +688,7 @@ previsoes[coluna] = predicao.yhat
 
 # total:
 coluna = 'total'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # # Transformação Box-Cox:
 # treino_box, best_lambda = stats.boxcox(treino.y+1)
@@ -704,11 +699,11 @@ treino.columns = ['ds','y']
 
 
 # Rodando modelo:
-m = Prophet()
+m = Prophet(uncertainty_samples=n_amostras)
 m.fit(treino)
 
-# Gerar previsão:
-predicao = m.predict(vetor_indice)
+# Gerar previsão e trajetórias simuladas (um único sorteio para os limites e os intervalos):
+predicao, amostras[coluna] = prever_com_amostras(m, vetor_indice)
 
 # # Transformação Inversa:
 # predicao.yhat = inv_boxcox(predicao.yhat, best_lambda)-1
@@ -723,7 +718,7 @@ display(predicao.tail())
 fig = m.plot(predicao, figsize=(9, 4), ylabel=coluna)
 fig.show()
 
-fig1 = m.plot_components(predicao)
+fig1 = m.plot_components(predicao, uncertainty=False)
 fig1.show()
 
 # Montando dataset para visão total
@@ -732,8 +727,7 @@ previsoes[coluna] = predicao.yhat
 
 # qtd_lesoes:
 coluna = 'qtd_lesoes'
-treino = df_EDA[['mes_ano',coluna]].copy()
-treino.columns = ['ds','y']
+treino, _ = derivadas.treino_prophet(coluna)
 
 # # Transformação Box-Cox:
 # treino_box, best_lambda = stats.boxcox(treino.y+1)
@@ -744,11 +738,11 @@ treino.columns = ['ds','y']
 
 
 # Rodando modelo:
-m = Prophet()
+m = Prophet(uncertainty_samples=n_amostras)
 m.fit(treino)
 
-# Gerar previsão:
-predicao = m.predict(vetor_indice)
+# Gerar previsão e trajetórias simuladas (um único sorteio para os limites e os intervalos):
+predicao, amostras[coluna] = prever_com_amostras(m, vetor_indice)
 
 # # Transformação Inversa:
 # predicao.yhat = inv_boxcox(predicao.yhat, best_lambda)-1
@@ -763,7 +757,7 @@ display(predicao.tail())
 fig = m.plot(predicao, figsize=(9, 4), ylabel=coluna)
 fig.show()
 
-fig1 = m.plot_components(predicao)
+fig1 = m.plot_components(predicao, uncertainty=False)
 fig1.show()
 
 # Montando dataset para visão total
@@ -782,9 +776,12 @@ px.line(previsoes,
         x='mes_ano',
         title = 'Comparação entre Previsão do Total de Exames e Soma das Previsões dos Exames por resultados')
 
-# Gerando totais de consumo por ano:
+# Gerando totais de consumo por ano (total e qtd_lesoes pela média das trajetórias usadas nos intervalos):
 previsoes['ano'] = previsoes.mes_ano.dt.year
-df_resumo = pd.pivot_table(previsoes, index = 'ano', aggfunc='sum')
+df_resumo = previsoes.drop(columns='mes_ano').groupby('ano').sum()
+for coluna in ['total', 'qtd_lesoes']:
+  anos_previsao, totais_anuais = somar_amostras_por_ano(vetor_indice.ds, amostras[coluna])
+  df_resumo.loc[anos_previsao, coluna] = totais_anuais.mean(axis=1)
 df_resumo
 
 """## 4. Proporcionalização
@@ -796,62 +793,68 @@ df_resumo
 df_exames_cidades.head(2)
 
 # Quantidade de exames por data e macrorregião:
-df_aux = pd.pivot_table(df_exames_cidades,index='data',columns='nome_rgint',values='qtd_exames', aggfunc='sum').reset_index()
+df_aux = pd.pivot_table(df_exames_cidades,index='data',columns='nome_rgint',values='qtd_exames_tratado', aggfunc='sum', observed=True).reset_index()
 df_aux
 
-# Medianas das quantidades de exames:
-medianas = []
-for col in df_aux.columns[1:]:
-  print(f'{col} - {df_aux[col].median()}')
-  medianas.append(df_aux[col].median())
+# Backtest das participações das regiões: erro em relação às participações realizadas (exames sem tratamento)
+# nos 12 meses seguintes e variação entre origens, com e sem filtro de picos; a linha 'referencia' é o método
+# original (mediana do histórico bruto, sem filtro):
+df_realizado = pd.pivot_table(df_exames_cidades, index='data', columns='nome_rgint', values='qtd_exames', aggfunc='sum', observed=True)
+df_backtest = backtest_participacoes(df_aux.set_index('data'), df_realizado=df_realizado)
+df_backtest.groupby(['metodo','filtrar'])[['erro','variacao']].mean()
 
-# Medianas e porcentagens das quantidades de exames:
-df_aux2 = pd.DataFrame()
-df_aux2['regioes'] = df_aux.columns[1:]
-df_aux2['medianas'] = medianas
-df_aux2['porcentagem'] = df_aux2['medianas'] / df_aux2['medianas'].sum()
-df_aux2
+# Participações das regiões pela combinação de método e filtro de menor erro no backtest:
+metodo_participacao, filtrar_participacao = melhor_configuracao(df_backtest)
+participacoes = estimar_participacoes(df_aux.set_index('data'), metodo=metodo_participacao, filtrar=filtrar_participacao)
+print(f'Método: {metodo_participacao} | filtro: {filtrar_participacao}')
+participacoes
 
 # Quantidade prevista de exames por região:
-df_resumo_exames = df_resumo[['total']].copy()
-for regiao in df_aux2.regioes:
-  df_resumo_exames[regiao] = (df_resumo_exames.total * df_aux2.loc[df_aux2.regioes == regiao, 'porcentagem'].iloc[0]).astype('int')
+df_resumo_exames = df_resumo[['total']].join(proporcionalizar(df_resumo.total, participacoes))
 df_resumo_exames
 
 # Quantidade de lesões previstas por região:
-df_resumo_lesoes = df_resumo[['qtd_lesoes']].copy()
-for regiao in df_aux2.regioes:
-  df_resumo_lesoes[regiao] = (df_resumo_lesoes.qtd_lesoes * df_aux2.loc[df_aux2.regioes == regiao, 'porcentagem'].iloc[0]).astype('int')
+df_resumo_lesoes = df_resumo[['qtd_lesoes']].join(proporcionalizar(df_resumo.qtd_lesoes, participacoes))
 df_resumo_lesoes
 
+# Intervalos de previsão de exames e lesões por região (trajetórias de Monte Carlo):
+anos_previsao, totais_exames = somar_amostras_por_ano(vetor_indice.ds, amostras['total'])
+anos_previsao, totais_lesoes = somar_amostras_por_ano(vetor_indice.ds, amostras['qtd_lesoes'])
+
+intervalos_exames_regioes = proporcionalizar_amostras(anos_previsao, totais_exames, participacoes)
+intervalos_lesoes_regioes = proporcionalizar_amostras(anos_previsao, totais_lesoes, participacoes)
+pd.concat(intervalos_exames_regioes, axis=1)
+
 """### Cidade"""
 
-df_aux = pd.pivot_table(df_exames_cidades,index='data',columns='CD_GEOCODI',values='qtd_exames', aggfunc='sum').reset_index()
+df_aux = pd.pivot_table(df_exames_cidades,index='data',columns='CD_GEOCODI',values='qtd_exames_tratado', aggfunc='sum').reset_index()
 df_aux
 
-medianas = []
-for col in df_aux.columns[1:]:
-  print(f'{col} - {df_aux[col].median()}')
-  medianas.append(df_aux[col].median())
+# Backtest das participações das cidades (comparadas com as participações realizadas sem tratamento;
+# 'referencia' = mediana do histórico bruto, sem filtro):
+df_realizado = pd.pivot_table(df_exames_cidades, index='data', columns='CD_GEOCODI', values='qtd_exames', aggfunc='sum')
+df_backtest = backtest_participacoes(df_aux.set_index('data'), df_realizado=df_realizado)
+df_backtest.groupby(['metodo','filtrar'])[['erro','variacao']].mean()
 
-df_aux2 = pd.DataFrame()
-df_aux2['cidades'] = df_aux.columns[1:]
-df_aux2['medianas'] = medianas
-df_aux2['porcentagem'] = df_aux2['medianas'] / df_aux2['medianas'].sum()
-df_aux2
+# Participações das cidades pela combinação de método e filtro de menor erro no backtest:
+metodo_participacao, filtrar_participacao = melhor_configuracao(df_backtest)
+participacoes = estimar_participacoes(df_aux.set_index('data'), metodo=metodo_participacao, filtrar=filtrar_participacao)
+print(f'Método: {metodo_participacao} | filtro: {filtrar_participacao}')
+participacoes
 
 # Quantidade de exames previstos por cidade:
-df_resumo_exames = df_resumo[['total']].copy()
-for cidade in df_aux2.cidades:
-  df_resumo_exames[cidade] = (df_resumo_exames.total * df_aux2.loc[df_aux2.cidades == cidade, 'porcentagem'].iloc[0]).astype('int')
+df_resumo_exames = df_resumo[['total']].join(proporcionalizar(df_resumo.total, participacoes))
 df_resumo_exames
 
 # Quantidade de lesões previstas por cidade:
-df_resumo_lesoes = df_resumo[['qtd_lesoes']].copy()
-for cidade in df_aux2.cidades:
-  df_resumo_lesoes[cidade] = (df_resumo_lesoes.qtd_lesoes * df_aux2.loc[df_aux2.cidades == cidade, 'porcentagem'].iloc[0]).astype('int')
+df_resumo_lesoes = df_resumo[['qtd_lesoes']].join(proporcionalizar(df_resumo.qtd_lesoes, participacoes))
 df_resumo_lesoes
 
+# Intervalos de previsão de exames e lesões por cidade (trajetórias de Monte Carlo):
+intervalos_exames_cidades = proporcionalizar_amostras(anos_previsao, totais_exames, participacoes)
+intervalos_lesoes_cidades = proporcionalizar_amostras(anos_previsao, totais_lesoes, participacoes)
+pd.concat(intervalos_exames_cidades, axis=1)
+
 df_previsoes_vyr = df_resumo_lesoes.iloc[:,1:].T
 df_previsoes_vyr = df_previsoes_vyr.reset_index()
 df_previsoes_vyr.columns = ['COD IBGE', 'Lesoes 2023', 'Lesoes 2024', 'Lesoes 2025']
@@ -862,4 +865,43 @@ df_previsoes_vyr = df_resumo_exames.iloc[:,1:].T
 df_previsoes_vyr = df_previsoes_vyr.reset_index()
 df_previsoes_vyr.columns = ['COD IBGE', 'Exames 2023', 'Exames 2024', 'Exames 2025']
 df_previsoes_vyr.to_excel('VYR_Exames.xlsx', index = False)
-df_previsoes_vyr
\ No newline at end of file
+df_previsoes_vyr
+
+# Exportar intervalos de previsão por cidade (uma linha por cidade e ano):
+for nome, intervalos in [('Exames', intervalos_exames_cidades), ('Lesoes', intervalos_lesoes_cidades)]:
+  df_intervalos_vyr = pd.concat({estatistica: df.stack() for estatistica, df in intervalos.items()}, axis=1).reset_index()
+  df_intervalos_vyr.columns = ['Ano', 'COD IBGE', 'Media', 'Inferior', 'Mediana', 'Superior']
+  df_intervalos_vyr[['COD IBGE', 'Ano', 'Inferior', 'Mediana', 'Superior', 'Media']].to_excel('VYR_'+nome+'_Intervalos.xlsx', index = False)
+df_intervalos_vyr
+
+"""## 5. Disponibilização dos resultados
+
+As quantidades históricas e previstas por cidade são exportadas em formato longo (uma linha por cidade e ano) para o servidor local de consultas (`servidor_consultas.py`), que as agrega por município, região e estado.
+
+Para iniciar o servidor e medir seu desempenho (requisições por segundo e latência p99):
+
+```
+python servidor_consultas.py --porta 8050
+python teste_carga.py --porta 8050 --conexoes 50 --requisicoes 200
+```
+
+Para o Brasil inteiro, o mesmo fluxo (leitura, regiões, previsão, proporcionalização e exportação) é executado por estado, cada um em um processo, pelo `pipeline_estados.py`. Os arquivos de cada estado ficam em `dados/<UF>/` (`resultados.csv`, `exames_cidades.csv` e `lesoes.csv`, exportados do Tabnet), as bases de cada estado em `saida/<UF>/` e as bases nacionais, lidas pelo servidor, em `saida/`:
+
+```
+python pipeline_estados.py --pasta-dados dados --pasta-saida saida --processos 8
+python servidor_consultas.py --porta 8050 --historico saida/base_historico.csv --previsoes saida/base_previsoes.csv
+```
+"""
+
+# Base histórica por cidade e ano:
+df_historico = mesclar(df_exames_cidades, df_lesoes_cancer[['municipio','data','qtd_lesoes']], on=['municipio','data'], how='left')
+df_historico = df_historico.groupby(['CD_GEOCODI','municipio','nome_rgint','ano'], observed=True)[['qtd_exames','qtd_lesoes']].sum().reset_index()
+df_historico.to_csv('base_historico.csv', index=False)
+df_historico
+
+# Base de previsões por cidade e ano:
+df_previsoes_base = df_resumo_exames.iloc[:,1:].reset_index().melt(id_vars='ano', var_name='CD_GEOCODI', value_name='qtd_exames')
+df_aux = df_resumo_lesoes.iloc[:,1:].reset_index().melt(id_vars='ano', var_name='CD_GEOCODI', value_name='qtd_lesoes')
+df_previsoes_base = df_previsoes_base.merge(df_aux, on=['ano','CD_GEOCODI'], how='left')
+df_previsoes_base.to_csv('base_previsoes.csv', index=False)
+df_previsoes_base
\ No newline at end of file
@@ -0,0 +1,83 @@
+# -*- coding: utf-8 -*-
+"""Teste de carga do servidor local de consultas (servidor_consultas.py).
+
+Abre várias conexões simultâneas, dispara requisições GET sobre uma lista de
+consultas e informa requisições por segundo e latências (p50, p99 e máxima).
+
+Uso:
+    python teste_carga.py --porta 8050 --conexoes 50 --requisicoes 200
+"""
+
+import argparse
+import asyncio
+import random
+import statistics
+import time
+
+# Consultas sorteadas em cada requisição:
+CONSULTAS = [
+    '/historico?nivel=estado',
+    '/historico?nivel=regiao',
+    '/historico?nivel=municipio&ano=2022',
+    '/historico?nivel=municipio&codigo=2927408',
+    '/historico?nivel=regiao&codigo=Salvador',
+    '/previsoes?nivel=estado',
+    '/previsoes?nivel=regiao&ano=2024',
+    '/previsoes?nivel=municipio&ano=2025',
+    '/previsoes?nivel=municipio&codigo=2927408',
+    '/saude'
+]
+
+
+# Cada conexão mantém o keep-alive e envia suas requisições em sequência:
+async def cliente(host, porta, quantidade, latencias, erros):
+  leitor, escritor = await asyncio.open_connection(host, porta)
+  try:
+    for _ in range(quantidade):
+      consulta = random.choice(CONSULTAS)
+      inicio = time.perf_counter()
+      escritor.write(f'GET {consulta} HTTP/1.1\r\nHost: {host}\r\n\r\n'.encode('latin-1'))
+      await escritor.drain()
+
+      status = int((await leitor.readline()).split()[1])
+      tamanho = 0
+      while True:
+        cabecalho = await leitor.readline()
+        if cabecalho in (b'\r\n', b''):
+          break
+        nome, _, valor = cabecalho.decode('latin-1').partition(':')
+        if nome.lower() == 'content-length':
+          tamanho = int(valor)
+      await leitor.readexactly(tamanho)
+
+      latencias.append(time.perf_counter() - inicio)
+      if status >= 500:
+        erros.append(status)
+  finally:
+    escritor.close()
+
+
+async def executar(host, porta, conexoes, requisicoes):
+  latencias, erros = [], []
+  inicio = time.perf_counter()
+  await asyncio.gather(*[cliente(host, porta, requisicoes, latencias, erros) for _ in range(conexoes)])
+  duracao = time.perf_counter() - inicio
+
+  percentis = statistics.quantiles(latencias, n=100)
+  print(f'Requisições: {len(latencias)} em {duracao:.2f} s ({conexoes} conexões)')
+  print(f'Requisições por segundo: {len(latencias) / duracao:.1f}')
+  print(f'Latência p50: {percentis[49] * 1000:.2f} ms')
+  print(f'Latência p99: {percentis[98] * 1000:.2f} ms')
+  print(f'Latência máxima: {max(latencias) * 1000:.2f} ms')
+  print(f'Erros: {len(erros)}')
+
+
+if __name__ == '__main__':
+  parser = argparse.ArgumentParser(description='Teste de carga do servidor local de consultas.')
+  parser.add_argument('--host', default='127.0.0.1')
+  parser.add_argument('--porta', type=int, default=8050)
+  parser.add_argument('--conexoes', type=int, default=50)
+  parser.add_argument('--requisicoes', type=int, default=200, help='requisições por conexão')
+  args = parser.parse_args()
+
+  asyncio.run(executar(args.host, args.porta, args.conexoes, args.requisicoes))
@@ -0,0 +1,179 @@
+# -*- coding: utf-8 -*-
+"""Validação da consistência dos arquivos do DataSUS antes da modelagem.
+
+As tabelas exportadas do Tabnet trazem uma linha e uma coluna de total e, no
+eixo dos meses, uma linha ou coluna "Ignorado" (quantidades sem mês informado).
+Cada tabela bruta é convertida uma única vez em matriz NumPy e todas as
+verificações são feitas sobre ela, de forma vetorizada:
+
+- estrutura: a última linha e a última coluna são de total;
+- soma_linhas / soma_colunas: a coluna de total é a soma das colunas e a linha
+  de total é a soma das linhas (em resultados: normais + alterados +
+  nao_visualizados + ignorados = total);
+- valores: sem faltantes nem negativos;
+- municipios: códigos de 6 dígitos, sem repetição;
+- rotulos_meses / meses_faltantes: meses reconhecidos e sem lacunas;
+- ignorado: quantidade sem mês informado, que fica fora da modelagem;
+- cobertura_meses: meses dos resultados ausentes nos demais arquivos (preenchidos com 0);
+- total_mensal: total mensal dos resultados = soma mensal dos exames por cidade;
+- regioes: municípios sem correspondência na planilha de regiões.
+
+Verificações de nível 'erro' invalidam a entrada; as de nível 'aviso' apenas
+registram perdas ou preenchimentos. O relatório é um dicionário serializável
+em JSON, com uma entrada por verificação.
+"""
+
+import json
+
+import numpy as np
+import pandas as pd
+
+ROTULO_TOTAL = 'Total'
+ROTULO_IGNORADO = 'Ignorado'
+
+MESES = ('JANEIRO', 'FEVEREIRO', 'MARÇO', 'ABRIL', 'MAIO', 'JUNHO',
+         'JULHO', 'AGOSTO', 'SETEMBRO', 'OUTUBRO', 'NOVEMBRO', 'DEZEMBRO')
+
+# Máximo de exemplos de violação guardados por verificação:
+LIMITE_EXEMPLOS = 10
+
+
+def _rotulos(valores):
+  return pd.Index(valores).astype(str).str.strip()
+
+
+# Rótulo MÊS/AAAA -> número sequencial do mês (ano*12 + mês - 1); -1 quando não reconhecido:
+def indices_meses(rotulos):
+  partes = pd.Series(rotulos).str.extract(r'^([^/]+)/(\d{4})$')
+  meses = partes[0].map({mes: indice for indice, mes in enumerate(MESES)})
+  indices = pd.to_numeric(partes[1]) * 12 + meses
+  return indices.fillna(-1).astype('int64').to_numpy()
+
+
+def rotulo_mes(indice):
+  return f'{MESES[indice % 12]}/{indice // 12}'
+
+
+def _registrar(verificacoes, dataset, verificacao, nivel, violacoes, exemplos=(), **detalhes):
+  verificacoes.append({
+      'dataset': dataset,
+      'verificacao': verificacao,
+      'nivel': nivel,
+      'ok': int(violacoes) == 0,
+      'violacoes': int(violacoes),
+      'exemplos': [str(exemplo) for exemplo in list(exemplos)[:LIMITE_EXEMPLOS]],
+      **detalhes
+  })
+
+
+# Remove, pelo rótulo (e não pela posição), o total e o "Ignorado" do eixo dos meses e,
+# nas tabelas por cidade, também a coluna de total. Nos resultados a coluna de total é mantida,
+# pois é a série 'total'. meses_em: 'linhas' (resultados) ou 'colunas' (por cidade).
+def remover_totais(df, meses_em='colunas'):
+  rotulos_linhas = [ROTULO_TOTAL, ROTULO_IGNORADO] if meses_em == 'linhas' else [ROTULO_TOTAL]
+  rotulos_colunas = [] if meses_em == 'linhas' else [ROTULO_TOTAL, ROTULO_IGNORADO]
+  linhas = ~_rotulos(df.iloc[:, 0]).isin(rotulos_linhas)
+  colunas = ~_rotulos(df.columns).isin(rotulos_colunas)
+  return df.loc[linhas, colunas]
+
+
+# Verificações de uma tabela bruta; devolve os totais mensais e os códigos dos municípios.
+def _validar_tabela(verificacoes, dataset, df, meses_em):
+  linhas = _rotulos(df.iloc[:, 0])
+  colunas = _rotulos(df.columns[1:])
+  valores = df.iloc[:, 1:].apply(pd.to_numeric, errors='coerce').to_numpy(dtype='float64')
+
+  faltantes = np.isnan(valores)
+  _registrar(verificacoes, dataset, 'valores', 'erro', faltantes.sum() + (valores < 0).sum(),
+             [f'{linhas[i]} | {colunas[j]}' for i, j in zip(*np.nonzero(faltantes | (valores < 0)))])
+  valores = np.where(faltantes, 0, valores)
+
+  linha_total, coluna_total = linhas == ROTULO_TOTAL, colunas == ROTULO_TOTAL
+  estrutura_ok = linhas[-1] == ROTULO_TOTAL and colunas[-1] == ROTULO_TOTAL and linha_total.sum() == coluna_total.sum() == 1
+  _registrar(verificacoes, dataset, 'estrutura', 'erro', not estrutura_ok,
+             [] if estrutura_ok else [f'última linha: {linhas[-1]!r}', f'última coluna: {colunas[-1]!r}'])
+  if not estrutura_ok:
+    return None
+
+  corpo = valores[:-1, :-1]
+  diferencas = corpo.sum(axis=1) - valores[:-1, -1]
+  _registrar(verificacoes, dataset, 'soma_linhas', 'erro', np.count_nonzero(diferencas),
+             [f'{linhas[i]}: soma {corpo[i].sum():.0f} != total {valores[i, -1]:.0f}' for i in np.flatnonzero(diferencas)])
+  diferencas = corpo.sum(axis=0) - valores[-1, :-1]
+  _registrar(verificacoes, dataset, 'soma_colunas', 'erro', np.count_nonzero(diferencas),
+             [f'{colunas[j]}: soma {corpo[:, j].sum():.0f} != total {valores[-1, j]:.0f}' for j in np.flatnonzero(diferencas)])
+
+  # Eixo dos meses e eixo das entidades (tipos de resultado ou municípios), sem os totais:
+  if meses_em == 'linhas':
+    rotulos_meses, rotulos_entidades, matriz = linhas[:-1], colunas[:-1], corpo
+  else:
+    rotulos_meses, rotulos_entidades, matriz = colunas[:-1], linhas[:-1], corpo.T
+
+  ignorado = rotulos_meses == ROTULO_IGNORADO
+  quantidade_ignorada = matriz[ignorado].sum()
+  _registrar(verificacoes, dataset, 'ignorado', 'aviso', quantidade_ignorada > 0,
+             quantidade=float(quantidade_ignorada), proporcao=round(float(quantidade_ignorada / max(corpo.sum(), 1)), 4))
+
+  rotulos_meses, matriz = rotulos_meses[~ignorado], matriz[~ignorado]
+  meses = indices_meses(rotulos_meses)
+  _registrar(verificacoes, dataset, 'rotulos_meses', 'erro', (meses < 0).sum(), rotulos_meses[meses < 0])
+  meses, matriz = meses[meses >= 0], matriz[meses >= 0]
+  if len(meses):
+    lacunas = np.setdiff1d(np.arange(meses.min(), meses.max() + 1), meses)
+    _registrar(verificacoes, dataset, 'meses_faltantes', 'aviso', len(lacunas), map(rotulo_mes, lacunas),
+               inicio=rotulo_mes(meses.min()), fim=rotulo_mes(meses.max()))
+
+  codigos = None
+  if meses_em == 'colunas':
+    codigos = pd.to_numeric(pd.Series(rotulos_entidades).str.extract(r'^(\d{6}) ')[0])
+    invalidos = codigos.isna().to_numpy() | codigos.duplicated(keep=False).to_numpy()
+    _registrar(verificacoes, dataset, 'municipios', 'erro', invalidos.sum(), rotulos_entidades[invalidos])
+    codigos = codigos.dropna().astype('int64').to_numpy()
+
+  return {'totais_mensais': pd.Series(matriz.sum(axis=1), index=meses), 'codigos': codigos}
+
+
+# Valida os três arquivos brutos (como lidos com pd.read_csv) e, opcionalmente, a
+# correspondência dos municípios com a planilha de regiões (coluna CD_GEOCODI).
+def validar_entradas(df_resultados, df_exames_cidades, df_lesoes, df_regioes=None):
+  verificacoes = []
+  resultados = _validar_tabela(verificacoes, 'resultados', df_resultados, 'linhas')
+  exames = _validar_tabela(verificacoes, 'exames_cidades', df_exames_cidades, 'colunas')
+  lesoes = _validar_tabela(verificacoes, 'lesoes', df_lesoes, 'colunas')
+
+  if resultados is not None:
+    meses_resultados = resultados['totais_mensais'].index
+    for dataset, info in [('exames_cidades', exames), ('lesoes', lesoes)]:
+      if info is not None:
+        ausentes = meses_resultados.difference(info['totais_mensais'].index)
+        _registrar(verificacoes, dataset, 'cobertura_meses', 'aviso', len(ausentes), map(rotulo_mes, ausentes))
+
+    if exames is not None:
+      totais = pd.concat([resultados['totais_mensais'], exames['totais_mensais']], axis=1, join='inner')
+      diferentes = totais[totais.iloc[:, 0] != totais.iloc[:, 1]]
+      _registrar(verificacoes, 'exames_cidades', 'total_mensal', 'erro', len(diferentes),
+                 [f'{rotulo_mes(mes)}: resultados {a:.0f} != cidades {b:.0f}' for mes, (a, b) in zip(diferentes.index, diferentes.to_numpy())])
+
+  if df_regioes is not None:
+    cod_reduzidos = df_regioes.CD_GEOCODI.dropna().astype('int64').to_numpy() // 10
+    for dataset, info in [('exames_cidades', exames), ('lesoes', lesoes)]:
+      if info is not None:
+        sem_regiao = info['codigos'][~np.isin(info['codigos'], cod_reduzidos)]
+        _registrar(verificacoes, dataset, 'regioes', 'aviso', len(sem_regiao), sem_regiao)
+
+  erros = sum(not v['ok'] for v in verificacoes if v['nivel'] == 'erro')
+  avisos = sum(not v['ok'] for v in verificacoes if v['nivel'] == 'aviso')
+  return {'ok': erros == 0, 'erros': erros, 'avisos': avisos, 'verificacoes': verificacoes}
+
+
+def salvar_relatorio(relatorio, caminho):
+  with open(caminho, 'w', encoding='utf-8') as f:
+    json.dump(relatorio, f, ensure_ascii=False, indent=2)
+
+
+# Interrompe a execução quando alguma verificação de nível 'erro' falhou:
+def exigir_consistencia(relatorio):
+  if not relatorio['ok']:
+    falhas = [f"{v['dataset']}.{v['verificacao']} ({v['violacoes']})" for v in relatorio['verificacoes']
+              if v['nivel'] == 'erro' and not v['ok']]
+    raise ValueError('entradas inconsistentes: ' + ', '.join(falhas))